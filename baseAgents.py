@@ -38,8 +38,21 @@ DO NOT MODIFY
 
 """
 
-import util, random
-import parameterSchedulers
+import os, util, random
+import numpy as np
+import parameterSchedulers, tables
+
+def splitEpisodes(numEpisodes, numWorkers = None, seed = None):
+    """
+    Splits numEpisodes episodes as evenly as possible over numWorkers worker processes (os.cpu_count() if None),
+    never more workers than episodes. 
+    Returns the episode count and the numpy.random.SeedSequence, spawned from seed, of each worker
+    """
+    if numWorkers is None:
+        numWorkers = os.cpu_count()
+    numWorkers = max(1, min(numWorkers, numEpisodes))
+    counts = [numEpisodes//numWorkers + (i < numEpisodes % numWorkers) for i in range(numWorkers)]
+    return counts, np.random.SeedSequence(seed).spawn(numWorkers)
 
 class BaseValueAgent():
     """
@@ -99,6 +112,16 @@ class BaseValueAgent():
         """
         return self.qvalues
 
+    def useQTable(self, model):
+        """
+        Replaces self.qvalues with a dense tables.QTable over the states and actions of a compiled model
+        (see gridworld.Gridworld.compile). The q-values stored so far are kept.
+        """
+        qtable = tables.QTable.fromModel(model)
+        qtable.fill(self.qvalues)
+        self.qvalues = qtable
+        return qtable
+
     def getActionValuesGivenState(self, state):
         """
         Return a list of values corresponding to Q(s,.) for each action
@@ -172,6 +195,39 @@ class BaseDpAgent(BaseValueAgent):
     def isTerminal(self,state):
         return self.mdp.isTerminal(state)
 
+    def warmStart(self, values = None, qvalues = None):
+        """
+        Makes the next run start from a previous solution instead of zeros.
+        values: A mapping of states to values, e.g. the getValues() of another agent
+        qvalues: A mapping of (state, action) pairs to q-values, e.g. the getQValues() of another agent
+        """
+        if values is not None:
+            for state, value in values.items():
+                self.values[state] = value
+        if qvalues is not None:
+            if isinstance(self.qvalues, tables.QTable):
+                self.qvalues.fill(qvalues)
+            else:
+                for key, value in qvalues.items():
+                    self.qvalues[key] = value
+
+    def resolve(self, newMdpParams):
+        """
+        Changes the parameters of the mdp and runs the agent again, starting from its current solution.
+        newMdpParams: A dictionary of parameter names and values, e.g. {'noise': 0.3, 'livingReward': -0.1}. 
+            Each one is set with the set<Name> method of the mdp. 
+            The discount belongs to the agent (it also scales its thresholds) and cannot be changed this way
+        Returns the result of run
+        """
+        if 'discount' in newMdpParams:
+            raise Exception("The discount is a parameter of the agent, create a new agent to change it!")
+        for name, value in newMdpParams.items():
+            setter = getattr(self.mdp, 'set' + name[:1].upper() + name[1:], None)
+            if setter is None:
+                raise Exception(f"Unknown mdp parameter {name}!")
+            setter(value)
+        return self.run()
+
 class BaseModelFreePredictionAgent(BaseValueAgent):
     """
     Base class for the model free pediction agent
@@ -195,6 +251,9 @@ class BaseModelFreePredictionAgent(BaseValueAgent):
         self.alpha = self.alphaScheduler.update()
 
 class BaseModelFreeControlAgent(BaseModelFreePredictionAgent):
+    # Whether newEpisode updates epsilon, agents that update it elsewhere call updateEpsilon themselves
+    updatesEpsilonPerEpisode = True
+
     def __init__(self, env, discount = 0.9, alpha = 0.01, alphaScheduler = None, epsilon = 0.3, epsilonScheduler = None):
         """
         env: Environment of the agent
@@ -213,6 +272,10 @@ class BaseModelFreeControlAgent(BaseModelFreePredictionAgent):
         
     def newEpisode(self):
         super().newEpisode()
+        if self.updatesEpsilonPerEpisode:
+            self.updateEpsilon()
+
+    def updateEpsilon(self):
         self.epsilon = self.epsilonScheduler.update()
 
 
@@ -0,0 +1,221 @@
+"""
+Benchmarks of the gridworld and the agents, written as JSON so that runs on different commits can be compared.
+
+Example:
+    python bench.py -g BookGrid,MazeGrid,Scaled40 -b transitions,steps,qi,vqi -o bench.json
+
+Grids are the built-in ones (BookGrid, BridgeGrid, CliffGrid, MazeGrid, DiscountGrid) or ScaledN,
+an N x N synthetic grid (see makeScaledGrid). Every benchmark does a fixed amount of work from a fixed seed
+and is repeated, the fastest repetition is reported:
+    compile: seconds to build the compiled model
+    transitions: getTransitionStatesAndProbs calls per second over all legal (state, action) pairs
+    steps: doAction steps per second with uniformly random legal actions
+    pe, pe-jacobi, pe-gs, qi, vqi, pi: full sweeps (Bellman backups of every state) per second,
+        pe copies the values every sweep, pe-jacobi uses whole-array updates and pe-gs updates in place
+    mcp, td, sr, ql: episodes and steps per second, the TD episodes are cut at maxSteps steps
+"""
+
+import json
+import optparse
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import gridworld
+import dpAgents
+import sweep
+
+GRIDS = ('BookGrid', 'BridgeGrid', 'CliffGrid', 'MazeGrid', 'DiscountGrid')
+PE_METHODS = {'pe': 'iterative', 'pe-jacobi': 'jacobi', 'pe-gs': 'gauss-seidel'}
+BENCHMARKS = ('compile', 'transitions', 'steps', 'pe', 'pe-jacobi', 'pe-gs', 'qi', 'vqi', 'pi', 'mcp', 'td', 'sr', 'ql')
+
+def makeScaledGrid(size):
+    """
+    Returns a size x size Gridworld that starts in the bottom left corner, with a +1 exit in the top right corner,
+    a -1 exit next to it and every fourth column walled off except for a gap that alternates between the ends
+    """
+    rows = [[' ']*size for _ in range(size)]
+    for x in range(3, size - 1, 4):
+        gap = 0 if (x//4) % 2 == 0 else size - 1
+        for y in range(size):
+            if y != gap:
+                rows[y][x] = '#'
+    rows[size - 1][0] = 'S'
+    rows[0][size - 1] = 1
+    rows[1][size - 1] = -1
+    return gridworld.Gridworld(rows)
+
+def getGrid(name):
+    if name.startswith('Scaled'):
+        return makeScaledGrid(int(name[len('Scaled'):]))
+    return getattr(gridworld, 'get' + name)()
+
+def _timeBest(function, repeat):
+    """
+    Calls function() repeat times and returns the shortest wall time
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        startTime = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - startTime)
+    return best
+
+def _legalPairs(mdp):
+    return [(state, action) for state in mdp.getStateIndex().states for action in mdp.getPossibleActions(state)]
+
+def benchCompile(mdp, opts):
+    def run():
+        mdp.invalidate()
+        mdp.compile()
+    return {'seconds': _timeBest(run, opts.repeat)}
+
+def benchTransitions(mdp, opts):
+    pairs = _legalPairs(mdp)
+    passes = max(1, opts.calls//len(pairs))
+    mdp.compile()
+    def run():
+        for _ in range(passes):
+            for state, action in pairs:
+                mdp.getTransitionStatesAndProbs(state, action)
+    return {'callsPerSecond': passes*len(pairs)/_timeBest(run, opts.repeat)}
+
+def benchSteps(mdp, opts):
+    env = gridworld.GridworldEnvironment(mdp)
+    def run():
+        random.seed(opts.seed)
+        env.reset()
+        for _ in range(opts.calls):
+            state = env.getCurrentState()
+            if mdp.isTerminal(state):
+                env.reset()
+                state = env.getCurrentState()
+            env.doAction(random.choice(mdp.getPossibleActions(state)))
+    return {'stepsPerSecond': opts.calls/_timeBest(run, opts.repeat)}
+
+def _numSweeps(mdp, opts):
+    return max(1, min(opts.sweeps, opts.calls//len(mdp.getStateIndex().states)))
+
+def benchSweeps(mdp, opts, algo):
+    """
+    Runs a fixed number of sweeps by making the convergence thresholds unreachable
+    """
+    env = gridworld.GridworldEnvironment(mdp)
+    sweeps = _numSweeps(mdp, opts)
+    def run():
+        random.seed(opts.seed)
+        if algo in PE_METHODS:
+            method = PE_METHODS[algo]
+            agent = dpAgents.PolicyEvaluationAgent(mdp, env, 0.9, None, -1, sweeps, method = method)
+        elif algo == 'qi':
+            agent = dpAgents.QValueIterationAgent(mdp, env, 0.9, maxIters = sweeps)
+        elif algo == 'vqi':
+            agent = dpAgents.VectorizedQValueIterationAgent(mdp, env, 0.9, maxIters = sweeps)
+        else:
+            # One improvement step after every evaluation sweep
+            agent = dpAgents.PolicyIterationAgent(mdp, env, discount = 0.9, evaluationIters = 1, maxPolicyIters = sweeps)
+        agent.errorThreshold = -1
+        agent.getPossibleActions = mdp.getPossibleActions
+        agent.isTerminal = mdp.isTerminal
+        agent.run()
+    return {'sweeps': sweeps, 'sweepsPerSecond': sweeps/_timeBest(run, opts.repeat)}
+
+def benchEpisodes(mdp, opts, algo):
+    config = {'algo': algo, 'discount': 0.9, 'epsilon': 0.3}
+    counts = {}
+    def run():
+        random.seed(opts.seed)
+        env = sweep.RecordingEnvironment(mdp)
+        agent = sweep.makeAgent(config, mdp, env)
+        _, truncated = sweep.runAgent(agent, algo, env, opts.episodes, opts.maxSteps)
+        counts['steps'] = env.numSteps
+        counts['truncated'] = truncated
+    seconds = _timeBest(run, opts.repeat)
+    return {'episodes': opts.episodes, 'steps': counts['steps'], 'truncated': counts['truncated'],
+            'episodesPerSecond': opts.episodes/seconds, 'stepsPerSecond': counts['steps']/seconds}
+
+def runBenchmark(name, mdp, opts):
+    """
+    Returns the measurements of a single benchmark on the grid as a dictionary
+    """
+    random.seed(opts.seed)
+    np.random.seed(opts.seed)
+    if name == 'compile':
+        return benchCompile(mdp, opts)
+    if name == 'transitions':
+        return benchTransitions(mdp, opts)
+    if name == 'steps':
+        return benchSteps(mdp, opts)
+    if name in ('pe', 'pe-jacobi', 'pe-gs', 'qi', 'vqi', 'pi'):
+        return benchSweeps(mdp, opts, name)
+    if name in ('mcp', 'td', 'sr', 'ql'):
+        return benchEpisodes(mdp, opts, name)
+    raise Exception(f"Unknown benchmark {name}!")
+
+def _getCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output = True, text = True, check = True).stdout.strip()
+    except Exception:
+        return None
+
+def parseOptions(argv = None):
+    optParser = optparse.OptionParser(usage = 'python bench.py [options], list options take comma separated values')
+    optParser.add_option('-g', '--grids',action='store',
+                         type='string',dest='grids',default=','.join(GRIDS + ('Scaled10', 'Scaled20')),
+                         help='Grids to run on, built-in names or ScaledN (default %default)')
+    optParser.add_option('-b', '--benchmarks',action='store',
+                         type='string',dest='benchmarks',default=','.join(BENCHMARKS),
+                         help='Benchmarks to run (default %default)')
+    optParser.add_option('-r', '--repeat',action='store',
+                         type='int',dest='repeat',default=3,
+                         help='Repetitions of each benchmark, the fastest is reported (default %default)')
+    optParser.add_option('-c', '--calls',action='store',
+                         type='int',dest='calls',default=20000,
+                         help='Calls of the transitions and steps benchmarks, also bounds the state backups of the sweep benchmarks (default %default)')
+    optParser.add_option('--sweeps',action='store',
+                         type='int',dest='sweeps',default=50,
+                         help='Maximum number of sweeps of the sweep benchmarks (default %default)')
+    optParser.add_option('-k', '--episodes',action='store',
+                         type='int',dest='episodes',default=100,
+                         help='Episodes of the episode benchmarks (default %default)')
+    optParser.add_option('-m', '--maxSteps',action='store',
+                         type='int',dest='maxSteps',default=1000,
+                         help='Maximum steps of an episode of the TD agents (default %default)')
+    optParser.add_option('-s', '--seed',action='store',
+                         type='int',dest='seed',default=123456,
+                         help='Random seed of every benchmark (default %default)')
+    optParser.add_option('-o', '--output',action='store',
+                         type='string',dest='output',default='-',
+                         help='JSON file to write the results to, - for stdout (default %default)')
+    opts, args = optParser.parse_args(argv)
+    return opts
+
+def runBenchmarks(opts):
+    """
+    Runs every benchmark on every grid and returns the JSON report as a dictionary
+    """
+    results = []
+    for gridName in opts.grids.split(','):
+        for name in opts.benchmarks.split(','):
+            mdp = getGrid(gridName)
+            result = {'benchmark': name, 'grid': gridName, 'numStates': len(mdp.getStateIndex())}
+            result.update(runBenchmark(name, mdp, opts))
+            results.append(result)
+    settings = {key: getattr(opts, key) for key in ('repeat', 'calls', 'sweeps', 'episodes', 'maxSteps', 'seed')}
+    return {'commit': _getCommit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'platform': platform.platform(), 'settings': settings, 'results': results}
+
+if __name__ == '__main__':
+    opts = parseOptions()
+    report = runBenchmarks(opts)
+    if opts.output == '-':
+        json.dump(report, sys.stdout, indent = 2)
+        print()
+    else:
+        with open(opts.output, 'w') as output:
+            json.dump(report, output, indent = 2)
+        print("FINISHED %d BENCHMARKS, RESULTS IN %s" % (len(report['results']), opts.output))
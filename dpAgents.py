@@ -29,8 +29,9 @@ AUTHORS: Baris Akgun
 
 """
 
-import util, copy, math, random
-import baseAgents, policies
+import util, copy, math, random, warnings
+import numpy as np
+import baseAgents, policies, tables
 
 """
 This agent is given to you as an example
@@ -39,7 +40,7 @@ class PolicyEvaluationAgent(baseAgents.BaseDpAgent):
     """
     Agent that runs the policy evaluation algorithm.
     """
-    def __init__(self, mdp, env, discount = 0.9, policy=None, errorThreshold = 0.001, maxIters=1000):
+    def __init__(self, mdp, env, discount = 0.9, policy=None, errorThreshold = 0.001, maxIters=1000, method='iterative', solver='lu'):
         """
         mdp: The underlying Markov Decision Process 
         env: Environment of the agent
@@ -47,10 +48,23 @@ class PolicyEvaluationAgent(baseAgents.BaseDpAgent):
         policy: The (initial or to be evaluated) policy of the agent
         errorThreshold: The approximation error threshold for value prediction. 
         maxIters: The maximum allowed iterations for policy evaluation. 
+        method: How the values are computed, needs mdp.compile() unless it is 'iterative'
+            'iterative': sweeps that copy the previous values
+            'jacobi': the same sweeps as whole-array updates alternating between two preallocated arrays
+            'gauss-seidel': in-place sweeps, each state uses the values already updated in the same sweep
+            'solve': solves V = (I - discount*P_pi)^-1 r_pi directly (needs scipy)
+        solver: The sparse solver used by the 'solve' method, 'lu' (direct) or 'gmres' (iterative, I - discount*P_pi is not symmetric).
+            gmres stops once the residual is below errorThreshold*(1-discount) and falls back to lu if it fails
         """
         super().__init__(mdp, env, discount, policy)
         self.errorThreshold = errorThreshold
         self.maxIters = maxIters
+        if method not in ('iterative', 'jacobi', 'gauss-seidel', 'solve'):
+            raise Exception(f"Unknown policy evaluation method {method}!")
+        if solver not in ('lu', 'gmres'):
+            raise Exception(f"Unknown linear solver {solver}!")
+        self.method = method
+        self.solver = solver
         
         if policy is None:
             self.policy = policies.RandomPolicy(self, returnProbabilities = True)
@@ -60,10 +74,98 @@ class PolicyEvaluationAgent(baseAgents.BaseDpAgent):
         The function that we call to calculate the values. 
         Returns the number of iterations
         """
+        if self.method == 'solve':
+            return self._solve()
+        if self.method != 'iterative':
+            self._prepareSweeps()
         thresh = self.errorThreshold*(1-self.discount)/self.discount
         for iters in range(self.maxIters):
             if(self._iter() < thresh):
                 break
+        if self.method != 'iterative':
+            self._writeValues(np.asarray(self._V))
+        return iters
+
+    def _policyTransitions(self, model):
+        """
+        Returns r_pi and the nonzeros of P_pi as (states, nextStates, probs) arrays, sorted by state
+        """
+        pi = self.policy.getProbabilityArray(model)
+        rPi = (pi*model.expectedRewards).sum(axis=1)
+        weights = model.probs*pi.reshape(-1)[model.rows]
+        keep = weights != 0
+        return rPi, model.rows[keep]//model.numActions, model.indices[keep], weights[keep]
+
+    def _prepareSweeps(self):
+        """
+        Builds the per-state successor arrays and the value buffers used by the jacobi and gauss-seidel sweeps.
+        P_pi is stored row-padded: state s moves to nextStates[s,k] with probability probs[s,k]
+        """
+        model = self.mdp.compile()
+        self.model = model
+        S = model.numStates
+        rPi, states, nextStates, probs = self._policyTransitions(model)
+        counts = np.bincount(states, minlength=S)
+        starts = np.zeros(S, dtype=np.int64)
+        np.cumsum(counts[:-1], out=starts[1:])
+        slots = np.arange(len(states)) - starts[states]
+        width = max(int(counts.max(initial=0)), 1)
+        self._rPi = rPi
+        self._nextStates = np.zeros((S, width), dtype=np.int64)
+        self._nextStates[states, slots] = nextStates
+        self._probs = np.zeros((S, width))
+        self._probs[states, slots] = probs
+
+        self._V = np.array([self.values[state] for state in model.states], dtype=float)
+        if self.method == 'jacobi':
+            self._Vnext = np.empty(S)
+            self._buffer = np.empty((S, width))
+        else:
+            ends = (starts + counts).tolist()
+            nextStates, probs = nextStates.tolist(), probs.tolist()
+            self._successorLists = [(nextStates[start:end], probs[start:end]) for start, end in zip(starts.tolist(), ends)]
+            self._rPiList = rPi.tolist()
+            self._V = self._V.tolist()
+
+    def _writeValues(self, V):
+        """
+        Copies the value array to self.values, keyed by state
+        """
+        for state, value in zip(self.model.states, V.tolist()):
+            self.values[state] = value
+
+    def _solve(self):
+        """
+        Evaluates the policy exactly with a single sparse linear solve. 
+        Returns the number of solver iterations (1 for the direct solver)
+        """
+        import scipy.sparse, scipy.sparse.linalg
+        model = self.mdp.compile()
+        self.model = model
+        rPi, states, nextStates, probs = self._policyTransitions(model)
+        PPi = scipy.sparse.csr_matrix((probs, (states, nextStates)),
+                                      shape=(model.numStates, model.numStates))
+        A = (scipy.sparse.identity(model.numStates, format='csr') - self.discount*PPi).tocsc()
+        if self.solver == 'lu':
+            V = scipy.sparse.linalg.splu(A).solve(rPi)
+            iters = 1
+        else:
+            iters = 0
+            def count(x):
+                nonlocal iters
+                iters += 1
+            x0 = np.array([self.values[state] for state in model.states], dtype=float)
+            # |V - V_pi| <= |r|/(1-discount) for the residual r = r_pi - A*V, so an absolute residual
+            # tolerance of errorThreshold*(1-discount) bounds the value error by errorThreshold like the sweeps do
+            tol = self.errorThreshold*(1-self.discount)
+            V, info = scipy.sparse.linalg.gmres(A, rPi, x0=x0, rtol=0.0, atol=tol, maxiter=self.maxIters, 
+                                                callback=count, callback_type='pr_norm')
+            if info != 0:
+                # Not converged in maxIters restart cycles, the direct solver is exact
+                warnings.warn(f"gmres failed (info {info}) after {iters} iterations, falling back to lu")
+                V = scipy.sparse.linalg.splu(A).solve(rPi)
+                iters += 1
+        self._writeValues(V)
         return iters
         
     def _iter(self):
@@ -71,23 +173,59 @@ class PolicyEvaluationAgent(baseAgents.BaseDpAgent):
         A single policy iteration evaluation. 
         Returns the maximum difference between previous values and current values
         """
+        if self.method == 'jacobi':
+            return self._jacobiIter()
+        if self.method == 'gauss-seidel':
+            return self._gaussSeidelIter()
         delta = -math.inf
         V = copy.deepcopy(self.values)
-        states = self.mdp.getStates()
+        states = self.mdp.getStateIndex().states
         for state in states:
             if self.mdp.isTerminal(state):
                 continue
             val = 0
             actions = self.mdp.getPossibleActions(state)
+            actionProbs = self.policy.policyProbs(state)
             for action in actions:
-                actionProbs = self.policy.policyProbs(state)
                 val += actionProbs[action]*self._getQValue(state, action, V)
             self.values[state] = val
             delta = max(abs(V[state]-val),delta)
         return delta
 
+    def _jacobiIter(self):
+        """
+        A single sweep V' = r_pi + discount*P_pi*V into the spare buffer, which then becomes the current one. 
+        Returns the maximum difference between previous values and current values
+        """
+        V, Vnext, buffer = self._V, self._Vnext, self._buffer
+        np.take(V, self._nextStates, out=buffer)
+        buffer *= self._probs
+        buffer.sum(axis=1, out=Vnext)
+        Vnext *= self.discount
+        Vnext += self._rPi
+        self._V, self._Vnext = Vnext, V
+        np.subtract(Vnext, V, out=V)
+        return np.abs(V, out=V).max()
+
+    def _gaussSeidelIter(self):
+        """
+        A single in-place sweep in state order. 
+        Returns the maximum difference between previous values and current values
+        """
+        delta = -math.inf
+        V = self._V
+        discount = self.discount
+        for s, (nextStates, probs) in enumerate(self._successorLists):
+            val = 0
+            for nextState, pr in zip(nextStates, probs):
+                val += pr*V[nextState]
+            val = self._rPiList[s] + discount*val
+            delta = max(abs(V[s]-val), delta)
+            V[s] = val
+        return delta
+
     def getQValues(self):
-        for state in self.mdp.getStates():
+        for state in self.mdp.getStateIndex().states:
             for action in self.mdp.getPossibleActions(state):
                 self.qvalues[(state,action)] = self.getQValue(state,action)
         return self.qvalues
@@ -124,6 +262,9 @@ class QValueIterationAgent(baseAgents.BaseDpAgent):
         
         self.policy = policies.PolicyFromQValues(self)
 
+        # Dense q-values, so the greedy actions come from the cache of the table
+        self.useQTable(mdp.compile())
+
         """
         You can add your own fields
         Recall that we initialize the q-values to all zeros already
@@ -159,7 +300,7 @@ class QValueIterationAgent(baseAgents.BaseDpAgent):
         Returns the maximum difference between previous values and current values
         """
         delta = 0
-        for state in self.mdp.getStates():
+        for state in self.mdp.getStateIndex().states:
             for action in self.mdp.getPossibleActions(state):
                 val = self._getQValue(state, action)
                 delta = max(abs(self.qvalues[(state, action)] - val), delta)
@@ -174,7 +315,7 @@ class QValueIterationAgent(baseAgents.BaseDpAgent):
 
     # fixed
     def getValues(self):
-        for state in self.mdp.getStates():
+        for state in self.mdp.getStateIndex().states:
             self.values[state] = self.getValue(state)
         return self.values
 
@@ -185,49 +326,236 @@ class QValueIterationAgent(baseAgents.BaseDpAgent):
             val += pr*(reward + self.discount*self.getValue(nextState))
         return val
 
-class PolicyIterationAgent(PolicyEvaluationAgent):
+class VectorizedQValueIterationAgent(QValueIterationAgent):
     """
-    Agent that runs the policy iteration algorithm. 
-    It extends the PolicyEvaluationAgent in case you want to use that functionality.
+    Agent that runs q-value iteration as whole-array Bellman backups
+    Q = R + discount*P*max_a(Q) over the compiled model of the mdp (see gridworld.Gridworld.compile)
+    The backups are synchronous, every Q(s,a) of an iteration uses the values of the previous one.
+    Each run starts from the current q-values. After run, self.qvalues is a tables.QTable over the Q array.
     """
-    def __init__(self, mdp, env, initialPolicy=None, discount = 0.9):
+    def __init__(self, mdp, env, discount = 0.9, errorThreshold = 0.001, maxIters=1000):
         """
-        mdp: The underlying Markov Decision Process 
+        mdp: The underlying Markov Decision Process, must provide compile()
         env: Environment of the agent
-        discount: The discount factor. Should actually be part of the mdp but this implementation makes the agent select it
-        policy: The (initial or to be evaluated) policy of the agent
+        discount: The discount factor. Should actually be part of the mdp but this implementation makes the agent select it.
         errorThreshold: The approximation error threshold for value prediction. 
         maxIters: The maximum allowed iterations for policy evaluation. 
         """
-        super().__init__(mdp, env, discount, initialPolicy, 0.01,10)
-        
+        super().__init__(mdp, env, discount, errorThreshold, maxIters)
+        self.model = None
+        self.Q = None
+
+    def run(self):
         """
-        You can add your own fields
+        Runs q-value iteration and fills self.qvalues. 
+        Returns the number of iterations
+        """
+        self.model = self.mdp.compile()
+        model = self.model
+        self.Q = self.qvalues.array.copy()
+        for iters in range(self.maxIters):
+            Q = model.expectedRewards + self.discount*model.expectedNextValues(self._maxQ(self.Q))
+            delta = np.abs(Q - self.Q).max()
+            self.Q = Q
+            if( delta < self.errorThreshold):
+                break
+        self._writeQValues()
+        return iters
+
+    def _maxQ(self, Q):
         """
+        Returns V(s) = max_a Q(s,a) over the legal actions, 0 for states without actions
+        """
+        V = np.where(self.model.legalActions, Q, -np.inf).max(axis=1)
+        V[~self.model.legalActions.any(axis=1)] = 0.0
+        return V
 
+    def _writeQValues(self):
+        """
+        Exposes the Q array as self.qvalues, a tables.QTable keyed by (state, action) pairs
+        """
+        self.qvalues = tables.QTable.fromModel(self.model, self.Q)
+
+    def getValues(self):
+        if self.Q is None:
+            return super().getValues()
+        for state, value in zip(self.model.states, self._maxQ(self.Q).tolist()):
+            self.values[state] = value
+        return self.values
+
+class PrioritizedSweepingAgent(QValueIterationAgent):
     """
-    You can add your own functions
+    Agent that runs asynchronous q-value iteration with prioritized sweeping. 
+    States are backed up one at a time in the order of their Bellman error, 
+    and only while that error is above the threshold of the q-value iteration agent.
     """
+    def __init__(self, mdp, env, discount = 0.9, errorThreshold = 0.001, maxIters=1000):
+        """
+        mdp: The underlying Markov Decision Process 
+        env: Environment of the agent
+        discount: The discount factor. Should actually be part of the mdp but this implementation makes the agent select it.
+        errorThreshold: The approximation error threshold for value prediction. 
+        maxIters: The maximum allowed iterations, in full sweeps. At most maxIters*|S| state backups are done.
+        """
+        super().__init__(mdp, env, discount, errorThreshold, maxIters)
+        self.numBackups = 0
 
     def run(self):
-        util.raiseNotDefined()
         """
-        Comment out the previous line and write your code here.
-        You need to implement policy iteration.
-        After this method is run, self.getPolicy must return the optimal policy
-        Feel free to add new methods
-        Do not forget to return the number of iterations
-        Hints:
-        - You need to deepcopy policies at each iteration
-        - super().run() would take care of the evaluation for you! However, this maybe inefficient if error threshold is low.
-        - You need to implement something to get the best action from the values (policy extraction)
-        - You need to implement something that compares two policies
-        - You can assume that you will always be given a TabularPolicy object (note that you need to have a "newPolicy" as well, 
-          e.g.  newPolicy = policies.TabularPolicy(self))
-          
-        return the number of iterations!
+        Backs up states until no Bellman error is above the threshold and fills self.qvalues. 
+        Returns the number of state backups
+        """
+        self.numBackups = 0
+        states = self.mdp.getStateIndex().states
+        predecessors = self._getPredecessors(states)
+        self.stateValues = {state: self.getValue(state) for state in states}
+
+        queue = util.PriorityQueue()
+        for state in states:
+            error, _ = self._getBellmanError(state)
+            if error > self.errorThreshold:
+                queue.push(state, -error)
+
+        maxBackups = self.maxIters*len(states)
+        while not queue.isEmpty() and self.numBackups < maxBackups:
+            state = queue.pop()
+            # The queue keeps outdated entries, the error is checked again
+            error, qVals = self._getBellmanError(state)
+            if error <= self.errorThreshold:
+                continue
+            for action, val in qVals.items():
+                self.qvalues[(state, action)] = val
+            self.stateValues[state] = max(qVals.values())
+            self.numBackups += 1
+            for predecessor in predecessors[state]:
+                error, _ = self._getBellmanError(predecessor)
+                if error > self.errorThreshold:
+                    queue.push(predecessor, -error)
+        return self.numBackups
+
+    def _getPredecessors(self, states):
         """
- 
-        #return iters
+        Returns a dictionary mapping each state to the set of states that can reach it in one step
+        """
+        predecessors = {state: set() for state in states}
+        for state in states:
+            for action in self.mdp.getPossibleActions(state):
+                for nextState, pr in self.mdp.getTransitionStatesAndProbs(state, action):
+                    if pr > 0:
+                        predecessors[nextState].add(state)
+        return predecessors
 
+    def _getBellmanError(self, state):
+        """
+        Returns max_a |Q(s,a) - backed up Q(s,a)| and a dictionary of the backed up q-values of the state
+        """
+        error = 0
+        qVals = {}
+        for action in self.mdp.getPossibleActions(state):
+            val = 0
+            for nextState, pr in self.mdp.getTransitionStatesAndProbs(state, action):
+                reward = self.mdp.getReward(state, action, nextState)
+                val += pr*(reward + self.discount*self.stateValues[nextState])
+            qVals[action] = val
+            error = max(abs(self.qvalues[(state, action)] - val), error)
+        return error, qVals
 
+class PolicyIterationAgent(PolicyEvaluationAgent):
+    """
+    Agent that runs (modified) policy iteration. 
+    Each evaluation step does at most evaluationIters backups of the current policy starting from the previous values,
+    followed by a greedy improvement. Works on the arrays of the compiled mdp (see gridworld.Gridworld.compile)
+    and keeps the policy as an array of action indices.
+    """
+    def __init__(self, mdp, env, initialPolicy=None, discount = 0.9, evaluationIters = 10, maxPolicyIters = 1000):
+        """
+        mdp: The underlying Markov Decision Process 
+        env: Environment of the agent
+        initialPolicy: The initial policy of the agent, a TabularPolicy. The first legal action of every state is used if not given
+        discount: The discount factor. Should actually be part of the mdp but this implementation makes the agent select it
+        evaluationIters: The maximum number of backups for each policy evaluation step. 
+        maxPolicyIters: The maximum allowed number of policy improvements. 
+        """
+        if evaluationIters < 1:
+            raise Exception("Policy iteration needs at least one backup per evaluation step!")
+        super().__init__(mdp, env, discount, initialPolicy, 0.01, evaluationIters)
+        self.initialPolicy = initialPolicy
+        self.maxPolicyIters = maxPolicyIters
+        self.policyActions = None
+
+    def run(self):
+        """
+        Alternates partial policy evaluation and greedy policy improvement until the policy is stable
+        and its evaluation has converged. 
+        Returns the number of iterations (policy improvements)
+        """
+        model = self.mdp.compile()
+        self.model = model
+        nextStates, probs, _ = model.getPaddedTransitions()
+        stateIds = np.arange(model.numStates)
+        hasActions = model.legalActions.any(axis=1)
+        thresh = self.errorThreshold*(1-self.discount)/self.discount
+
+        actions = self._getInitialActions(model)
+        V = np.array([self.values[state] for state in model.states], dtype=float)
+        for iters in range(self.maxPolicyIters):
+            # Partial evaluation of the current policy
+            policyNext = nextStates[stateIds, actions]
+            policyProbs = probs[stateIds, actions]
+            policyRewards = np.where(hasActions, model.expectedRewards[stateIds, actions], 0.0)
+            for _ in range(self.maxIters):
+                newV = policyRewards + self.discount*(policyProbs*V[policyNext]).sum(axis=1)
+                delta = np.abs(newV - V).max()
+                V = newV
+                if delta < thresh:
+                    break
+
+            # Greedy improvement, keeping the current action on ties
+            newActions = self._getGreedyActions(V, actions)
+            stable = np.array_equal(newActions, actions)
+            actions = newActions
+            if stable and delta < thresh:
+                break
+
+        self.policyActions = actions
+        self._writeValues(V)
+        self.policy = policies.TabularPolicy(self, self._getPolicyTable(actions))
+        return iters
+
+    def _getInitialActions(self, model):
+        """
+        Returns the initial policy as an array of action indices, the policy of the previous run if there is one
+        """
+        if self.policyActions is not None:
+            return self.policyActions
+        actions = np.argmax(model.legalActions, axis=1)
+        if isinstance(self.initialPolicy, policies.TabularPolicy):
+            for state, action in self.initialPolicy.policyTable.items():
+                s = model.stateIndex.get(state)
+                if s is not None and action in model.actionIndex and model.legalActions[s, model.actionIndex[action]]:
+                    actions[s] = model.actionIndex[action]
+        return actions
+
+    def _getGreedyActions(self, V, actions):
+        """
+        Policy extraction, returns argmax_a( sum_s'( P(s'|s,a)*(R(s,a,s')+discount*V(s')) ) ) for every state
+        The given actions are kept unless another action is better by more than the evaluation threshold,
+        differences below it are within the error of the partially evaluated values
+        """
+        model = self.model
+        nextStates, probs, _ = model.getPaddedTransitions()
+        Q = model.expectedRewards + self.discount*(probs*V[nextStates]).sum(axis=2)
+        Q[~model.legalActions] = -np.inf
+        greedy = Q.argmax(axis=1)
+        stateIds = np.arange(model.numStates)
+        thresh = self.errorThreshold*(1-self.discount)/self.discount
+        keep = Q[stateIds, actions] >= Q[stateIds, greedy] - thresh
+        return np.where(keep, actions, greedy)
+
+    def _getPolicyTable(self, actions):
+        """
+        Converts the action index array to a {state: action} dictionary, None for states without actions
+        """
+        hasActions = self.model.legalActions.any(axis=1).tolist()
+        return {state: (self.model.actions[a] if legal else None)
+                for state, a, legal in zip(self.model.states, actions.tolist(), hasActions)}
@@ -32,7 +32,7 @@ class GraphicsGridworldDisplay:
     def displayValuesGivenAgent(self, agent, currentState = None, message = 'Agent Values'):
         values = util.Counter()
         policy = {}
-        states = self.gridworld.getStates()
+        states = self.gridworld.getStateIndex().states
         for state in states:
             values[state] = agent.getValue(state)
             policy[state] = agent.getPolicy(state)
@@ -46,7 +46,7 @@ class GraphicsGridworldDisplay:
     def displayNullValues(self, currentState = None, message = ''):
         values = util.Counter()
         #policy = {}
-        states = self.gridworld.getStates()
+        states = self.gridworld.getStateIndex().states
         for state in states:
             values[state] = 0.0
             #policy[state] = agent.getPolicy(state)
@@ -56,7 +56,7 @@ class GraphicsGridworldDisplay:
 
     def displayQValuesGivenAgent(self, agent, currentState = None, message = 'Agent Q-Values'):
         qValues = util.Counter()
-        states = self.gridworld.getStates()
+        states = self.gridworld.getStateIndex().states
         for state in states:
             for action in self.gridworld.getPossibleActions(state):
                 qValues[(state, action)] = agent.getQValue(state, action)
@@ -113,7 +113,7 @@ def drawNullValues(gridworld, currentState = None, message = ''):
 def drawValues(gridworld, values, policy, currentState = None, message = 'State Values'):
     grid = gridworld.grid
     blank()
-    valueList = [values[state] for state in gridworld.getStates()] + [0.0]
+    valueList = [values[state] for state in gridworld.getStateIndex().states] + [0.0]
     minValue = min(valueList)
     maxValue = max(valueList)
     for x in range(grid.width):
@@ -141,7 +141,7 @@ def drawValues(gridworld, values, policy, currentState = None, message = 'State
 def drawQValues(gridworld, qValues, currentState = None, message = 'State-Action Q-Values'):
     grid = gridworld.grid
     blank()
-    stateCrossActions = [[(state, action) for action in gridworld.getPossibleActions(state)] for state in gridworld.getStates()]
+    stateCrossActions = [[(state, action) for action in gridworld.getPossibleActions(state)] for state in gridworld.getStateIndex().states]
     qStates = functools.reduce(lambda x,y: x+y, stateCrossActions, [])
     qValueList = [qValues[(state, action)] for state, action in qStates] + [0.0]
     minValue = min(qValueList)
@@ -15,10 +15,16 @@
 
 import random
 import sys
+import bisect
+import itertools
 import mdp
 import environment
 import util
 import optparse
+import types
+import numpy as np
+
+ACTIONS = ('north', 'west', 'south', 'east', 'exit')
 
 class Gridworld(mdp.MarkovDecisionProcess):
     """
@@ -34,6 +40,10 @@ class Gridworld(mdp.MarkovDecisionProcess):
         self.noise = 0.2
         self.discount = 1.
 
+        # compiled transition model, see compile(), and state index, see getStateIndex()
+        self._compiled = None
+        self._stateIndex = None
+
     def setDiscount(self, discount):
         self.discount = discount
 
@@ -46,12 +56,49 @@ class Gridworld(mdp.MarkovDecisionProcess):
         future rewards.
         """
         self.livingReward = reward
+        self._compiled = None
 
     def setNoise(self, noise):
         """
         The probability of moving in an unintended direction.
         """
         self.noise = noise
+        self._compiled = None
+
+    def compile(self):
+        """
+        Returns the CompiledGridworld (state index, sparse transition and
+        reward arrays) for the current parameters, building it if needed.
+
+        The model is rebuilt after setNoise or setLivingReward. Changing
+        the grid itself requires calling invalidate().
+        """
+        if self._compiled is None:
+            self._compiled = CompiledGridworld(self)
+        return self._compiled
+
+    def getStateIndex(self):
+        """
+        Returns the StateIndex of the grid, built once. 
+        Changing the grid itself requires calling invalidate().
+        """
+        if self._stateIndex is None:
+            self._stateIndex = StateIndex(self._computeStates())
+        return self._stateIndex
+
+    def __getstate__(self):
+        # The compiled model and the state index are rebuilt on demand, e.g. in worker processes
+        state = self.__dict__.copy()
+        state['_compiled'] = None
+        state['_stateIndex'] = None
+        return state
+
+    def invalidate(self):
+        """
+        Drops the compiled model and the state index so that they are rebuilt.
+        """
+        self._compiled = None
+        self._stateIndex = None
 
 
     def getPossibleActions(self, state):
@@ -73,6 +120,9 @@ class Gridworld(mdp.MarkovDecisionProcess):
         """
         Return list of all states.
         """
+        return list(self.getStateIndex().states)
+
+    def _computeStates(self):
         # The true terminal state.
         states = [self.grid.terminalState]
         for x in range(self.grid.width):
@@ -122,6 +172,19 @@ class Gridworld(mdp.MarkovDecisionProcess):
         representing the states reachable
         from 'state' by taking 'action' along
         with their transition probabilities.
+
+        Answers from the compiled model; the returned list is shared
+        and must not be modified.
+        """
+        successors = self.compile().getTransitionStatesAndProbs(state, action)
+        if successors is None:
+            successors = self._computeTransitionStatesAndProbs(state, action)
+        return successors
+
+    def _computeTransitionStatesAndProbs(self, state, action):
+        """
+        Uncached version of getTransitionStatesAndProbs, used for the
+        (state, action) pairs that are not part of the compiled model.
         """
 
         if action not in self.getPossibleActions(state):
@@ -181,9 +244,228 @@ class Gridworld(mdp.MarkovDecisionProcess):
         if x < 0 or x >= self.grid.width: return False
         return self.grid[x][y] != '#'
 
+class StateIndex:
+    """
+    Immutable index of the states of a Gridworld, in getStates() order:
+    states is a tuple of the states, index a read-only dict from a state to its position 
+    and stateSet a frozenset of them. `state in stateIndex` is O(1).
+    """
+    def __init__(self, states):
+        self.states = tuple(states)
+        self.index = types.MappingProxyType({state: i for i, state in enumerate(self.states)})
+        self.stateSet = frozenset(self.states)
+
+    def __contains__(self, state):
+        return state in self.stateSet
+
+    def __iter__(self):
+        return iter(self.states)
+
+    def __len__(self):
+        return len(self.states)
+
+class CompiledGridworld:
+    """
+    Array form of a Gridworld for the current noise and living reward.
+
+    States are numbered in getStates() order and actions in ACTIONS order.
+    Row r = s*numActions + a of the CSR arrays holds the successors of
+    (state s, action a): they are indices[indptr[r]:indptr[r+1]] with
+    probabilities probs[...] and rewards rewards[...], i.e. the nonzero
+    pattern of P[s,a,s'] and R[s,a,s']. Illegal actions have empty rows.
+    Successors keep the order of Gridworld._computeTransitionStatesAndProbs.
+    """
+    def __init__(self, gridworld):
+        grid = gridworld.grid
+        self.states = gridworld.getStates()
+        self.stateIndex = dict(gridworld.getStateIndex().index)
+        self.actions = ACTIONS
+        self.actionIndex = {action: a for a, action in enumerate(ACTIONS)}
+        self.terminalIndex = 0
+        self.numStates = len(self.states)
+        self.numActions = len(ACTIONS)
+        S, A = self.numStates, self.numActions
+
+        # Cell information of the non-terminal states; state 0 is the terminal state
+        xs = np.array([state[0] for state in self.states[1:]], dtype=np.int64)
+        ys = np.array([state[1] for state in self.states[1:]], dtype=np.int64)
+        cells = [grid[x][y] for x, y in self.states[1:]]
+        isExitCell = np.array([type(cell) == int for cell in cells], dtype=bool)
+        isRewardCell = np.array([type(cell) == int or type(cell) == float for cell in cells], dtype=bool)
+        cellRewards = np.array([cell if type(cell) == int or type(cell) == float else 0.0 for cell in cells], dtype=float)
+
+        # lookup[x+1, y+1] is the index of state (x,y), -1 for walls and outside of the grid
+        lookup = -np.ones((grid.width + 2, grid.height + 2), dtype=np.int64)
+        lookup[xs + 1, ys + 1] = np.arange(1, S)
+        own = np.arange(1, S)
+        def neighbor(dx, dy):
+            n = lookup[xs + 1 + dx, ys + 1 + dy]
+            return np.where(n < 0, own, n)
+        north, west, south, east = neighbor(0, 1), neighbor(-1, 0), neighbor(0, -1), neighbor(1, 0)
+
+        # Three candidate successors per move: the intended one, then the two perpendicular ones
+        noise = gridworld.noise
+        cand = np.zeros((S, A, 3), dtype=np.int64)
+        prob = np.zeros((S, A, 3))
+        alive = np.zeros((S, A, 3), dtype=bool)
+        moves = {'north': (north, west, east), 'west': (west, north, south),
+                 'south': (south, west, east), 'east': (east, north, south)}
+        for action, (intended, left, right) in moves.items():
+            a = self.actionIndex[action]
+            cand[1:, a] = np.stack((intended, left, right), axis=1)
+            prob[1:, a] = (1 - noise, noise/2.0, noise/2.0)
+            alive[1:, a] = True
+
+        # Aggregate repeated successors into their first occurrence
+        same = cand[..., 1] == cand[..., 0]
+        prob[..., 0] += np.where(same, prob[..., 1], 0.0)
+        alive[..., 1] &= ~same
+        same = cand[..., 2] == cand[..., 0]
+        prob[..., 0] += np.where(same, prob[..., 2], 0.0)
+        alive[..., 2] &= ~same
+        same = (cand[..., 2] == cand[..., 1]) & alive[..., 1] & alive[..., 2]
+        prob[..., 1] += np.where(same, prob[..., 2], 0.0)
+        alive[..., 2] &= ~same
+
+        # Legal actions; reward cells move every legal action to the terminal state
+        legal = np.zeros((S, A), dtype=bool)
+        legal[1:, :4] = ~isExitCell[:, None]
+        legal[1:, 4] = isExitCell
+        rew = np.full((S, A, 3), float(gridworld.livingReward))
+        rewardRows = np.zeros(S, dtype=bool)
+        rewardRows[1:] = isRewardCell
+        cand[rewardRows] = 0
+        prob[rewardRows] = (1.0, 0.0, 0.0)
+        alive[rewardRows] = (True, False, False)
+        rew[1:][isRewardCell] = cellRewards[isRewardCell][:, None, None]
+        alive &= legal[..., None]
+        alive[0] = False
+
+        self.legalActions = legal
+        counts = alive.sum(axis=2).reshape(-1)
+        self.indptr = np.zeros(S*A + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.indptr[1:])
+        self.indices = cand[alive]
+        self.probs = prob[alive]
+        self.rewards = rew[alive]
+
+        # Row of every nonzero and the expected immediate rewards sum_s' P[s,a,s']*R[s,a,s']
+        self.rows = np.repeat(np.arange(S*A), counts)
+        self.expectedRewards = np.bincount(self.rows, weights=self.probs*self.rewards,
+                                           minlength=S*A).reshape(S, A)
+
+        self._padded = None
+        self._cumProbs = None
+        self._successors = {}
+        self._sampleTables = {}
+        self._indptrList = self.indptr.tolist()
+        self._indicesList = self.indices.tolist()
+        self._probsList = self.probs.tolist()
+        self._rewardsList = self.rewards.tolist()
+
+    def expectedNextValues(self, values):
+        """
+        Returns the (numStates, numActions) array of sum_s' P[s,a,s']*values[s']
+        """
+        return np.bincount(self.rows, weights=self.probs*values[self.indices],
+                           minlength=self.numStates*self.numActions).reshape(self.numStates, self.numActions)
+
+    def getPaddedTransitions(self):
+        """
+        Returns the transitions as three (numStates, numActions, width) arrays, nextStates, probs and rewards,
+        where width is the largest number of successors of a row. Missing successors have probability 0.
+        """
+        if self._padded is None:
+            S, A = self.numStates, self.numActions
+            counts = np.diff(self.indptr)
+            width = max(int(counts.max(initial=0)), 1)
+            slots = np.arange(len(self.indices)) - self.indptr[self.rows]
+            nextStates = np.zeros((S*A, width), dtype=np.int64)
+            probs = np.zeros((S*A, width))
+            rewards = np.zeros((S*A, width))
+            nextStates[self.rows, slots] = self.indices
+            probs[self.rows, slots] = self.probs
+            rewards[self.rows, slots] = self.rewards
+            self._padded = (nextStates.reshape(S, A, width), probs.reshape(S, A, width),
+                            rewards.reshape(S, A, width))
+        return self._padded
+
+    def getCumulativeProbs(self):
+        """
+        Returns the (numStates, numActions, width) cumulative probabilities of the padded transitions.
+        The last successor of each row is set to inf so that it takes any mass lost to rounding.
+        """
+        if self._cumProbs is None:
+            _, probs, _ = self.getPaddedTransitions()
+            counts = np.diff(self.indptr).reshape(probs.shape[:2])
+            self._cumProbs = np.cumsum(probs, axis=2)
+            self._cumProbs[np.arange(probs.shape[2]) >= counts[..., None] - 1] = np.inf
+        return self._cumProbs
+
+    def sampleTransitions(self, states, actions, rng):
+        """
+        Samples a successor for every (states[i], actions[i]) pair of index arrays with the numpy.random.Generator rng.
+        The pairs must be legal. Returns the (nextStates, rewards) arrays.
+        """
+        nextStates, _, rewards = self.getPaddedTransitions()
+        cumProbs = self.getCumulativeProbs()[states, actions]
+        slots = (rng.random(len(cumProbs))[:, None] >= cumProbs).sum(axis=1)
+        return nextStates[states, actions, slots], rewards[states, actions, slots]
+
+    def getSampleTable(self, state, action):
+        """
+        Returns the cached (nextStates, cumulativeProbs, rewards) lists of (state, action),
+        or None if it is not a legal pair of the model. The last cumulative probability is inf.
+        """
+        key = (state, action)
+        table = self._sampleTables.get(key)
+        if table is None:
+            row = self.rowIndex(state, action)
+            if row is None:
+                return None
+            start, end = self._indptrList[row], self._indptrList[row+1]
+            nextStates = [self.states[j] for j in self._indicesList[start:end]]
+            cumProbs = list(itertools.accumulate(self._probsList[start:end]))
+            cumProbs[-1] = float('inf')
+            table = (nextStates, cumProbs, self._rewardsList[start:end])
+            self._sampleTables[key] = table
+        return table
+
+    def rowIndex(self, state, action):
+        """
+        Returns the CSR row of (state, action), None if it is not in the model
+        """
+        s = self.stateIndex.get(state)
+        a = self.actionIndex.get(action)
+        if s is None or a is None or not self.legalActions[s, a]:
+            return None
+        return s*self.numActions + a
+
+    def getTransitionStatesAndProbs(self, state, action):
+        """
+        Returns the cached list of (nextState, prob) pairs, or None if
+        (state, action) is not a legal pair of the model.
+        """
+        key = (state, action)
+        successors = self._successors.get(key)
+        if successors is None:
+            row = self.rowIndex(state, action)
+            if row is None:
+                return None
+            start, end = self._indptrList[row], self._indptrList[row+1]
+            successors = [(self.states[j], p) for j, p in
+                          zip(self._indicesList[start:end], self._probsList[start:end])]
+            self._successors[key] = successors
+        return successors
+
 class GridworldEnvironment(environment.Environment):
 
-    def __init__(self, gridWorld, display, pause):
+    def __init__(self, gridWorld, display=None, pause=None):
+        """
+        gridWorld: The Gridworld to run
+        display: Called with the current state before every action, skipped if None
+        pause: Called before every action, skipped if None
+        """
         self.gridWorld = gridWorld
         self.display = display
         self.pause = pause
@@ -197,8 +479,10 @@ class GridworldEnvironment(environment.Environment):
 
     def doAction(self, action):
         state = self.getCurrentState()
-        self.display(state)
-        self.pause()
+        if self.display is not None:
+            self.display(state)
+        if self.pause is not None:
+            self.pause()
         (nextState, reward) = self.getRandomNextState(state, action)
         self.state = nextState
         return (nextState, reward)
@@ -209,20 +493,76 @@ class GridworldEnvironment(environment.Environment):
             rand = random.random()
         else:
             rand = randObj.random()
+        table = self.gridWorld.compile().getSampleTable(state, action)
+        if table is not None:
+            nextStates, cumProbs, rewards = table
+            i = bisect.bisect_right(cumProbs, rand)
+            return (nextStates[i], rewards[i])
         sum = 0.0
         successors = self.gridWorld.getTransitionStatesAndProbs(state, action)
         for nextState, prob in successors:
             sum += prob
             if sum > 1.0:
-                raise 'Total transition probability more than one; sample failure.'
+                raise Exception('Total transition probability more than one; sample failure.')
             if rand < sum:
                 reward = self.gridWorld.getReward(state, action, nextState)
                 return (nextState, reward)
-        raise 'Total transition probability less than one; sample failure.'
+        raise Exception('Total transition probability less than one; sample failure.')
 
     def reset(self):
         self.state = self.gridWorld.getStartState()
 
+class VecGridworldEnv:
+    """
+    numEnvs independent copies of a gridworld stepped together.
+
+    States and actions are indices into the compiled model (see Gridworld.compile),
+    so model.states[s] and ACTIONS[a] give the usual state and action objects.
+    An environment that reaches the terminal state starts again from the start state.
+    There is no display or pause callback.
+    """
+    def __init__(self, gridWorld, numEnvs, seed=None):
+        """
+        gridWorld: The Gridworld to copy
+        numEnvs: The number of environments
+        seed: Seed or numpy.random.Generator for the transition samples
+        """
+        self.gridWorld = gridWorld
+        self.numEnvs = numEnvs
+        self.rng = np.random.default_rng(seed)
+        self.model = gridWorld.compile()
+        self.startState = self.model.stateIndex[gridWorld.getStartState()]
+        self.legalActions = self.model.legalActions
+        self.numEpisodes = 0
+        self.reset()
+
+    def reset(self):
+        """
+        Puts every environment in the start state and returns the states
+        """
+        self.states = np.full(self.numEnvs, self.startState, dtype=np.int64)
+        return self.states.copy()
+
+    def getCurrentStates(self):
+        return self.states.copy()
+
+    def step(self, actions):
+        """
+        Takes actions[i] in environment i. 
+        Returns (nextStates, rewards, dones); nextStates holds the state reached, 
+        even when the environment was reset to the start state afterwards.
+        """
+        actions = np.asarray(actions, dtype=np.int64)
+        states = self.states
+        if not self.legalActions[states, actions].all():
+            i = int(np.argmin(self.legalActions[states, actions]))
+            raise Exception(f"Illegal action, {ACTIONS[actions[i]]} at state {self.model.states[states[i]]}!")
+        nextStates, rewards = self.model.sampleTransitions(states, actions, self.rng)
+        dones = nextStates == self.model.terminalIndex
+        self.numEpisodes += int(dones.sum())
+        self.states = np.where(dones, self.startState, nextStates)
+        return nextStates, rewards, dones
+
 class Grid:
     """
     A 2-dimensional array of immutables backed by a list of lists.  Data is accessed
@@ -367,7 +707,7 @@ def runManual(environment, discount, message, episode):
         # GET ACTION (USUALLY FROM AGENT)
         action = getUserAction(state, environment.getPossibleActions)
         if action == None:
-            raise 'Error: Agent returned None action'
+            raise Exception('Error: Agent returned None action')
 
         # EXECUTE ACTION
         nextState, reward = environment.doAction(action)
@@ -59,6 +59,27 @@ def parseOptions():
     optParser.add_option('-l', '--learningRate',action='store',
                          type='float',dest='learningRate',default=0.5,
                          metavar="P", help='TD learning rate (default %default)' )
+    optParser.add_option('--nSteps',action='store',
+                         type='int',dest='nSteps',default=4,
+                         metavar="N", help='Number of steps of n-step TD prediction (default %default)' )
+    optParser.add_option('--lambda',action='store',
+                         type='float',dest='lambd',default=0.9,
+                         metavar="L", help='Trace decay of TD(lambda) prediction (default %default)' )
+    optParser.add_option('--planningSteps',action='store',
+                         type='int',dest='planningSteps',default=10,
+                         metavar="K", help='Number of Dyna-Q planning updates per real step (default %default)' )
+    optParser.add_option('--prioritized',action='store_true',
+                         dest='prioritized',default=False,
+                         help='Pick the Dyna-Q planning updates by priority instead of uniformly')
+    optParser.add_option('--replay',action='store',
+                         type='int',dest='replay',default=0,
+                         metavar="N", help='Capacity of the Q-learning experience replay buffer, 0 learns from each step directly (default %default)' )
+    optParser.add_option('--replayBatch',action='store',
+                         type='int',dest='replayBatch',default=32,
+                         metavar="B", help='Minibatch size of Q-learning experience replay (default %default)' )
+    optParser.add_option('--prioritizedReplay',action='store_true',
+                         dest='prioritizedReplay',default=False,
+                         help='Sample the replayed transitions by their TD errors')
     optParser.add_option('-i', '--iterations',action='store',
                          type='int',dest='iters',default=100,
                          metavar="I", help='Maximum number of iterations for DP methods (default %default).')
@@ -72,7 +93,25 @@ def parseOptions():
                          help='Request a window width of X pixels *per grid cell* (default %default)')
     optParser.add_option('-a', '--algorithm',action='store', metavar="A",
                          type='string',dest='algo',default="mcp",
-                         help='Agent to run (options are pe: Policy Evaluation, qi: Q-Value Iteration (Not Q-Learning!), pe:Policy Iteration, mcp: Monte Carlo Prediction, mcc: Monte Carlo Control, td: Temporal Difference Prediction, sr: Sarsa, ql: Q-Learning, default: %default)')
+                         help='Agent to run (options are pe: Policy Evaluation, qi: Q-Value Iteration (Not Q-Learning!), vqi: Vectorized Q-Value Iteration, ps: Prioritized Sweeping Q-Value Iteration, pe:Policy Iteration, mcp: Monte Carlo Prediction, mcc: Monte Carlo Control, mco: Off-policy Monte Carlo Control, td: Temporal Difference Prediction, ntd: n-step TD Prediction, tdl: TD(lambda) Prediction, sr: Sarsa, ql: Q-Learning, esr: Expected Sarsa, dql: Double Q-Learning, dq: Dyna-Q, default: %default)')
+    optParser.add_option('--peMethod',action='store', metavar="M",
+                         type='choice',choices=['iterative','jacobi','gauss-seidel','solve'],dest='peMethod',default='iterative',
+                         help='Policy evaluation method, sweeps or a direct sparse linear solve (options are iterative, jacobi, gauss-seidel, solve, default %default)')
+    optParser.add_option('--solver',action='store', metavar="L",
+                         type='choice',choices=['lu','gmres'],dest='solver',default='lu',
+                         help='Sparse linear solver for --peMethod solve (options are lu, gmres, default %default)')
+    optParser.add_option('--workers',action='store',
+                         type='int',dest='workers',default=0,
+                         metavar="W", help='Number of worker processes to generate Monte Carlo episodes or run Q-learning with, 0 runs them in this process (default %default)')
+    optParser.add_option('--lockStripes',action='store',
+                         type='int',dest='lockStripes',default=0,
+                         metavar="S", help='Number of locks over the states of multi-process Q-learning, 0 updates without locks (default %default)')
+    optParser.add_option('--batchSize',action='store',
+                         type='int',dest='batchSize',default=1,
+                         metavar="B", help='Number of episodes per Monte Carlo control update (default %default)')
+    optParser.add_option('--qtable',action='store_true',
+                         dest='qtable',default=False,
+                         help='Store the q-values of the model free control agents in a dense array backed table')
     optParser.add_option('-t', '--text',action='store_true',
                          dest='textDisplay',default=False,
                          help='Use text-only ASCII display')
@@ -82,6 +121,12 @@ def parseOptions():
     optParser.add_option('-q', '--quiet',action='store_true',
                          dest='quiet',default=False,
                          help='Skip display of any learning episodes')
+    optParser.add_option('--headless',action='store_true',
+                         dest='headless',default=False,
+                         help='Run without any display, implies -q and --noPng; neither the text nor the graphics display is loaded')
+    optParser.add_option('--noPng',action='store_false',
+                         dest='png',default=True,
+                         help='Do not write the final graphics display to a PNG file')
     optParser.add_option('-s', '--speed',action='store', metavar="S", type=float,
                          dest='speed',default=1.0,
                          help='Speed of animation, S > 1.0 is faster, 0.0 < S < 1.0 is slower (default %default)')
@@ -101,6 +146,12 @@ def parseOptions():
         opts.agent = None
 
     # MANAGE CONFLICTS
+    if opts.headless:
+        if opts.manual:
+            optParser.error('Manual mode (-m) needs a display, it cannot be used with --headless')
+        opts.quiet = True
+        opts.png = False
+
     if opts.textDisplay or opts.quiet:
     # if opts.quiet:
         opts.pause = False
@@ -131,15 +182,17 @@ if __name__ == '__main__':
     # GET THE DISPLAY ADAPTER
     ###########################
 
-    import textGridworldDisplay
-    display = textGridworldDisplay.TextGridworldDisplay(mdp)
-    if not opts.textDisplay:
-        import graphicsGridworldDisplay
-        display = graphicsGridworldDisplay.GraphicsGridworldDisplay(mdp, opts.gridSize, opts.speed)
-    try:
-        display.start()
-    except KeyboardInterrupt:
-        sys.exit(0)
+    display = None
+    if not opts.headless:
+        import textGridworldDisplay
+        display = textGridworldDisplay.TextGridworldDisplay(mdp)
+        if not opts.textDisplay:
+            import graphicsGridworldDisplay
+            display = graphicsGridworldDisplay.GraphicsGridworldDisplay(mdp, opts.gridSize, opts.speed)
+        try:
+            display.start()
+        except KeyboardInterrupt:
+            sys.exit(0)
 
     values = util.Counter()
     qvalues = util.Counter()
@@ -163,15 +216,16 @@ if __name__ == '__main__':
 
     # FIGURE OUT WHAT TO DISPLAY EACH TIME STEP (IF ANYTHING)
 
-    if opts.algo == 'qi' or opts.algo == 'sr' or opts.algo == 'ql' or opts.algo == 'srl' or opts.algo == 'mcc':
+    if opts.algo == 'qi' or opts.algo == 'vqi' or opts.algo == 'ps' or opts.algo == 'sr' or opts.algo == 'ql' or opts.algo == 'srl' or opts.algo == 'mcc' or opts.algo == 'mco' or opts.algo == 'esr' or opts.algo == 'dql' or opts.algo == 'dq':
         opts.dQv = True
         
-    if opts.algo == 'pe' or opts.algo == 'qi' or opts.algo == 'pi' or opts.algo == 'vi':
+    if opts.algo == 'pe' or opts.algo == 'qi' or opts.algo == 'vqi' or opts.algo == 'ps' or opts.algo == 'pi' or opts.algo == 'vi':
         vizIter = True
     else:
         vizIter = False
 
-    displayCallback = lambda x: None
+    # None skips the callback in the environment altogether
+    displayCallback = None
     if not opts.quiet:
         if opts.manual and opts.agent == None:
             displayCallback = lambda state: display.displayNullValues(state)
@@ -187,7 +241,7 @@ if __name__ == '__main__':
         messageCallback = lambda x: None
 
     # FIGURE OUT WHETHER TO WAIT FOR A KEY PRESS AFTER EACH TIME STEP
-    pauseCallback = lambda : None
+    pauseCallback = None
     if opts.pause:
         pauseCallback = lambda : display.pause()
 
@@ -222,7 +276,7 @@ if __name__ == '__main__':
 
     # Policy evaluation, implemented for you
     if opts.algo == 'pe':
-        pe = dpAgents.PolicyEvaluationAgent(mdp, env, discount = opts.discount, maxIters = opts.iters)
+        pe = dpAgents.PolicyEvaluationAgent(mdp, env, discount = opts.discount, maxIters = opts.iters, method = opts.peMethod, solver = opts.solver)
         opts.iters = pe.run()
         values = pe.getValues()
     
@@ -233,9 +287,23 @@ if __name__ == '__main__':
         qvalues = qi.getQValues()
         policy = qi.policy
     
+    # Q-Value Iteration with whole-array backups over the compiled gridworld
+    elif opts.algo == 'vqi':
+        vqi = dpAgents.VectorizedQValueIterationAgent(mdp, env, discount = opts.discount, maxIters = opts.iters)
+        opts.iters=vqi.run()
+        qvalues = vqi.getQValues()
+        policy = vqi.policy
+    
+    # Asynchronous Q-Value Iteration with prioritized sweeping, reports the number of state backups
+    elif opts.algo == 'ps':
+        ps = dpAgents.PrioritizedSweepingAgent(mdp, env, discount = opts.discount, maxIters = opts.iters)
+        opts.iters=ps.run()
+        qvalues = ps.getQValues()
+        policy = ps.policy
+    
     # Policy Iteration, you need to implement this
     elif opts.algo == 'pi':
-        pi = dpAgents.PolicyIterationAgent(mdp, env, discount = opts.discount)
+        pi = dpAgents.PolicyIterationAgent(mdp, env, discount = opts.discount, maxPolicyIters = opts.iters)
         opts.iters = pi.run()
         values = pi.getValues()
         policy = pi.policy
@@ -250,25 +318,50 @@ if __name__ == '__main__':
         mcp = mcAgents.MonteCarloPredictionAgent(env, discount = opts.discount)
         mcp.getPossibleActions = mdp.getPossibleActions
         mcp.isTerminal = mdp.isTerminal
-        for i in range(0, opts.episodes):
-            env.reset()
-            mcp.run()
+        if opts.workers > 0:
+            mcp.runParallel(opts.episodes, opts.workers, seed = random.randrange(2**32))
             values = mcp.getValues()
-            # display.displayValues(values)
-            # display.pause()
+        else:
+            for i in range(0, opts.episodes):
+                env.reset()
+                mcp.run()
+                values = mcp.getValues()
+                # display.displayValues(values)
+                # display.pause()
 
     # Monte Carlo Control, you need to implement this
     elif opts.algo == 'mcc':
-        mcc = mcAgents.MonteCarloControlAgent(env, discount = opts.discount)
+        mcc = mcAgents.MonteCarloControlAgent(env, discount = opts.discount, epsilon = opts.epsilon, batchSize = opts.batchSize)
         mcc.getPossibleActions = mdp.getPossibleActions
         mcc.isTerminal = mdp.isTerminal
-        for i in range(0, opts.episodes):
-            env.reset()
-            mcc.run()
-            qvalues = mcc.getQValues()
-            #display.displayQValues(qvalues)
-            #display.pause()
+        if opts.qtable:
+            mcc.useQTable(mdp.compile())
+        if opts.workers > 0:
+            seed = random.randrange(2**32)
+            for i in range(0, opts.episodes, opts.batchSize):
+                mcc.runBatch(min(opts.batchSize, opts.episodes - i), opts.workers, seed = seed + i)
+                qvalues = mcc.getQValues()
+        else:
+            for i in range(0, opts.episodes):
+                env.reset()
+                mcc.run()
+                qvalues = mcc.getQValues()
+                #display.displayQValues(qvalues)
+                #display.pause()
+            mcc.update()
             
+    # Off-policy Monte Carlo Control from random behaviour episodes
+    elif opts.algo == 'mco':
+        mco = mcAgents.OffPolicyMonteCarloAgent(env, discount = opts.discount)
+        mco.getPossibleActions = mdp.getPossibleActions
+        mco.isTerminal = mdp.isTerminal
+        if opts.qtable:
+            mco.useQTable(mdp.compile())
+        for i in range(0, opts.episodes, opts.batchSize):
+            mco.generateEpisodes(min(opts.batchSize, opts.episodes - i))
+            mco.update()
+            qvalues = mco.getQValues()
+
     # Temporal Difference Prediction, you need to implement this
     elif opts.algo == 'td':
         td = tdAgents.TemporalDifferencePredictionAgent(env, discount = opts.discount)
@@ -282,11 +375,27 @@ if __name__ == '__main__':
                 #display.displayValues()
                 #display.pause()
     
+    # n-step TD and TD(lambda) Prediction
+    elif opts.algo == 'ntd' or opts.algo == 'tdl':
+        if opts.algo == 'ntd':
+            td = tdAgents.NStepTDPredictionAgent(env, discount = opts.discount, n = opts.nSteps)
+        else:
+            td = tdAgents.TDLambdaPredictionAgent(env, discount = opts.discount, lambd = opts.lambd)
+        td.getPossibleActions = mdp.getPossibleActions
+        td.isTerminal = mdp.isTerminal
+        for i in range(0, opts.episodes):
+            env.reset()
+            td.newEpisode()
+            while(td.run()): #run until the end of an episode
+                values=td.values
+    
     # Sarsa control, you need to implement this
     elif opts.algo == 'sr': 
         sr = tdAgents.SarsaAgent(env, discount = opts.discount, epsilon = opts.epsilon)
         sr.getPossibleActions = mdp.getPossibleActions
         sr.isTerminal = mdp.isTerminal
+        if opts.qtable:
+            sr.useQTable(mdp.compile())
         for i in range(0, opts.episodes):
             env.reset()
             sr.newEpisode()
@@ -298,22 +407,74 @@ if __name__ == '__main__':
 
     # Q-Learning, you need to implement this
     elif opts.algo == 'ql':
-        ql = tdAgents.QLearningAgent(env, discount = opts.discount, epsilon = opts.epsilon)
-        ql.getPossibleActions = mdp.getPossibleActions
-        ql.isTerminal = mdp.isTerminal
+        if opts.workers > 0:
+            ql = tdAgents.HogwildQLearningAgent(env, discount = opts.discount, epsilon = opts.epsilon, 
+                                                numWorkers = opts.workers, lockStripes = opts.lockStripes)
+            ql.getPossibleActions = mdp.getPossibleActions
+            ql.isTerminal = mdp.isTerminal
+            qvalues = ql.runParallel(opts.episodes, seed = random.randrange(2**32))
+            if not opts.quiet:
+                metrics = ql.metrics[-1]
+                print("%d STEPS IN %.2f SECONDS (%.0f STEPS/S), MEAN ABS TD ERROR %.4f" 
+                      % (metrics['steps'], metrics['time'], metrics['stepsPerSecond'], metrics['meanAbsTDError']))
+        else:
+            replayBuffer = None
+            if opts.replay > 0:
+                replayBuffer = tdAgents.ReplayBuffer(opts.replay, prioritized = opts.prioritizedReplay, seed = random.randrange(2**32))
+            ql = tdAgents.QLearningAgent(env, discount = opts.discount, epsilon = opts.epsilon, 
+                                         replayBuffer = replayBuffer, batchSize = opts.replayBatch)
+            ql.getPossibleActions = mdp.getPossibleActions
+            ql.isTerminal = mdp.isTerminal
+            if opts.qtable:
+                ql.useQTable(mdp.compile())
+            for i in range(0, opts.episodes):
+                env.reset()
+                ql.newEpisode()
+                while(ql.run()): #run until the end of an episode
+                    qvalues=ql.getQValues()
+                    #display.displayQValues(qvalues, ql.getPolicy())
+                    #display.pause()
+        policy=ql.getPolicy()
+
+    # Expected Sarsa and Double Q-Learning
+    elif opts.algo == 'esr' or opts.algo == 'dql':
+        if opts.algo == 'esr':
+            td = tdAgents.ExpectedSarsaAgent(env, discount = opts.discount, epsilon = opts.epsilon)
+        else:
+            td = tdAgents.DoubleQLearningAgent(env, discount = opts.discount, epsilon = opts.epsilon)
+        td.getPossibleActions = mdp.getPossibleActions
+        td.isTerminal = mdp.isTerminal
         for i in range(0, opts.episodes):
             env.reset()
-            ql.newEpisode()
-            while(ql.run()): #run until the end of an episode
-                qvalues=ql.getQValues()
-                #display.displayQValues(qvalues, ql.getPolicy())
-                #display.pause()
-        policy=ql.getPolicy()
+            td.newEpisode()
+            while(td.run()): #run until the end of an episode
+                qvalues=td.getQValues()
+        policy=td.getPolicy()
+
+    # Dyna-Q
+    elif opts.algo == 'dq':
+        dq = tdAgents.DynaQAgent(env, discount = opts.discount, epsilon = opts.epsilon, 
+                                 planningSteps = opts.planningSteps, prioritized = opts.prioritized)
+        dq.getPossibleActions = mdp.getPossibleActions
+        dq.isTerminal = mdp.isTerminal
+        for i in range(0, opts.episodes):
+            env.reset()
+            dq.newEpisode()
+            while(dq.run()): #run until the end of an episode
+                qvalues=dq.getQValues()
+        policy=dq.getPolicy()
 
     #for key in values.keys():
     #    print(key,values[key])
     #print(qvalues)
 
+    if opts.headless:
+        if vizIter:
+            print("FINISHED AFTER "+str(opts.iters)+" ITERATIONS")
+        else:
+            print("FINISHED AFTER "+str(opts.episodes)+" EPISODES")
+        sys.exit(0)
+
     # DISPLAY POST-LEARNING VALUES / Q-VALUES
     if not opts.manual:
         try:
@@ -333,8 +494,9 @@ if __name__ == '__main__':
                 sleep(1.0)
         except KeyboardInterrupt:
             sys.exit(0)
-    import graphicsUtils
-        
-    #graphicsUtils.writePostscript('latest'+opts.algo+'.eps')
-    graphicsUtils.writePng('latest_'+opts.algo+'_'+opts.grid+'.png')
+
+    if opts.png and not opts.textDisplay:
+        import graphicsUtils
+        #graphicsUtils.writePostscript('latest'+opts.algo+'.eps')
+        graphicsUtils.writePng('latest_'+opts.algo+'_'+opts.grid+'.png')
 
@@ -29,8 +29,201 @@ AUTHORS: Baris Akgun
 
 """
 
-import random, util
-import baseAgents, policies
+import random, util, bisect
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import baseAgents, policies, parameterSchedulers
+
+def discountedReturns(rewards, discount, episodeStarts = None):
+    """
+    Returns the array of G(t) = R(t) + discount*G(t+1) for the rewards of one or more episodes stored back to back.
+    episodeStarts: The indices where the episodes begin, the rewards are a single episode if None
+
+    The recurrence runs backwards over a list of floats, which is linear in the number of steps for any discount.
+    """
+    returns = np.asarray(rewards, dtype=float).tolist()
+    n = len(returns)
+    if episodeStarts is None:
+        episodeStarts = [0]
+    bounds = [start for start in np.asarray(episodeStarts, dtype=np.int64).tolist() if start < n] + [n]
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        G = 0.0
+        for t in range(end - 1, start - 1, -1):
+            G = returns[t] + discount*G
+            returns[t] = G
+    return np.array(returns)
+
+def accumulateReturns(states, returns, firstVisit = False, episodeStarts = None):
+    """
+    Sums the returns of the given steps per state, states can be any non-negative integer keys
+    such as state-action indices. 
+    Returns the visited states and their return sums and visit counts as three compact arrays.
+    firstVisit: Only count the first visit of a state in each episode
+    episodeStarts: The indices where the episodes begin, the steps are a single episode if None
+    """
+    states = np.asarray(states, dtype=np.int64)
+    returns = np.asarray(returns, dtype=float)
+    if firstVisit and len(states) > 0:
+        episodes = np.zeros(len(states), dtype=np.int64)
+        if episodeStarts is not None:
+            starts = np.asarray(episodeStarts, dtype=np.int64)
+            starts = starts[(starts > 0) & (starts < len(states))]
+            episodes[starts] = 1
+            episodes = np.cumsum(episodes)
+        _, first = np.unique(episodes*(states.max() + 1) + states, return_index=True)
+        states, returns = states[first], returns[first]
+    visited, inverse = np.unique(states, return_inverse=True)
+    returnSums = np.zeros(len(visited))
+    np.add.at(returnSums, inverse, returns)
+    visitCounts = np.bincount(inverse, minlength=len(visited))
+    return visited, returnSums, visitCounts
+
+class EpisodeBuffer:
+    """
+    State indices, action indices and rewards of one or more episodes in preallocated arrays.
+    The arrays double in size when they are full.
+    """
+    def __init__(self, capacity = 1024):
+        self.states = np.empty(capacity, dtype=np.int64)
+        self.actions = np.empty(capacity, dtype=np.int64)
+        self.rewards = np.empty(capacity)
+        self.clear()
+
+    def clear(self):
+        self.length = 0
+        self.episodeStarts = [0]
+
+    def append(self, state, action, reward):
+        if self.length == len(self.states):
+            self._grow()
+        n = self.length
+        self.states[n] = state
+        self.actions[n] = action
+        self.rewards[n] = reward
+        self.length = n + 1
+
+    def endEpisode(self):
+        """
+        Marks the end of the current episode, the next steps belong to a new one
+        """
+        self.episodeStarts.append(self.length)
+
+    def getStates(self):
+        return self.states[:self.length]
+
+    def getActions(self):
+        return self.actions[:self.length]
+
+    def getRewards(self):
+        return self.rewards[:self.length]
+
+    def getReturns(self, discount):
+        return discountedReturns(self.getRewards(), discount, self.episodeStarts)
+
+    def _grow(self):
+        capacity = 2*len(self.states)
+        for name in ('states', 'actions', 'rewards'):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+def _runEpisodes(gridWorld, policyProbs, discount, numEpisodes, seedSequence, firstVisit = False, perAction = False):
+    """
+    Worker of the parallel MC agents, runs in its own process.
+    gridWorld: The Gridworld to run the episodes on, from its start state
+    policyProbs: pi(a|s) as an array in the order of gridWorld.compile()
+    discount: The discount factor
+    numEpisodes: The number of episodes to run
+    seedSequence: The numpy.random.SeedSequence of this worker
+    firstVisit: Only count the first visit of a state (or state-action pair) in each episode
+    perAction: Accumulate the returns per state-action pair, with keys state*numActions + action
+    Returns the visited states (or keys) and their return sums and visit counts, see accumulateReturns
+    """
+    model = gridWorld.compile()
+    rng = np.random.default_rng(seedSequence)
+    nextStates, _, rewards = model.getPaddedTransitions()
+    nextStates, rewards = nextStates.tolist(), rewards.tolist()
+    cumProbs = model.getCumulativeProbs().tolist()
+    # The last action with nonzero probability takes the mass lost to rounding
+    policyCumProbs = np.cumsum(policyProbs, axis=1)
+    lastActions = model.numActions - 1 - np.argmax(policyProbs[:, ::-1] > 0, axis=1)
+    policyCumProbs[np.arange(model.numActions) >= lastActions[:, None]] = np.inf
+    policyCumProbs = policyCumProbs.tolist()
+    start = model.stateIndex[gridWorld.getStartState()]
+    terminal = model.terminalIndex
+
+    # Python lists are cheaper to append to one step at a time, all episodes are converted at once
+    states, episodeRewards, episodeStarts = [], [], []
+    numActions = model.numActions if perAction else 0
+    samples, pos = [], 0
+    for _ in range(numEpisodes):
+        episodeStarts.append(len(states))
+        state = start
+        while state != terminal:
+            if pos + 2 > len(samples):
+                samples, pos = rng.random(1 << 16).tolist(), 0
+            action = bisect.bisect_right(policyCumProbs[state], samples[pos])
+            slot = bisect.bisect_right(cumProbs[state][action], samples[pos+1])
+            pos += 2
+            states.append(state*numActions + action if perAction else state)
+            episodeRewards.append(rewards[state][action][slot])
+            state = nextStates[state][action][slot]
+    returns = discountedReturns(episodeRewards, discount, episodeStarts)
+    return accumulateReturns(states, returns, firstVisit, episodeStarts)
+
+def _recordEpisode(agent, model, selectAction):
+    """
+    Runs a single episode on the environment of the agent, taking the actions selectAction(state), 
+    and stores it in agent.episodeBuffer as state and action indices of the compiled model
+    """
+    buffer = agent.episodeBuffer
+    buffer.clear()
+    currentState = agent.env.getCurrentState()
+    while True:
+        action = selectAction(currentState)
+        nextState, reward = agent.takeAction(action)
+        buffer.append(model.stateIndex[currentState], model.actionIndex[action], reward)
+        if agent.isTerminal(nextState):
+            break
+        currentState = nextState
+    buffer.endEpisode()
+    return buffer
+
+def _epsilonGreedyProbs(qvalues, model, epsilon):
+    """
+    Returns the epsilon-greedy pi(a|s) of a (state, action) mapping of q-values as a (numStates, numActions) 
+    array in the order of a compiled model. Ties go to the first action in model.actions.
+    """
+    legal = model.legalActions
+    Q = np.zeros(legal.shape)
+    for s, a in zip(*np.nonzero(legal)):
+        Q[s, a] = qvalues[(model.states[s], model.actions[a])]
+    numLegal = legal.sum(axis=1, keepdims=True)
+    probs = np.where(legal, epsilon/np.maximum(numLegal, 1), 0.0)
+    greedy = np.where(legal, Q, -np.inf).argmax(axis=1)
+    hasActions = legal.any(axis=1)
+    probs[hasActions, greedy[hasActions]] += 1 - epsilon
+    return probs
+
+def _suffixProducts(values, episodeStarts):
+    """
+    Returns prod(values[t+1:end]) for every step t, where end is the end of the episode of t.
+    The products are taken as sums of logs, zeros are counted separately.
+    """
+    n = len(values)
+    episodeStarts = np.asarray(episodeStarts, dtype=np.int64)
+    episodeStarts = episodeStarts[episodeStarts < n]
+    episodeEnds = np.append(episodeStarts[1:], n)
+    isEpisodeStart = np.zeros(n, dtype=np.int64)
+    isEpisodeStart[episodeStarts] = 1
+    lastSteps = episodeEnds[np.cumsum(isEpisodeStart) - 1] - 1
+    isZero = values == 0
+    logSums = np.cumsum(np.log(np.where(isZero, 1.0, values)))
+    zeroCounts = np.cumsum(isZero)
+    products = np.exp(logSums[lastSteps] - logSums)
+    products[zeroCounts[lastSteps] > zeroCounts] = 0.0
+    return products
 
 """
 This class is given to you as an example
@@ -39,102 +232,286 @@ class MonteCarloPredictionAgent(baseAgents.BaseModelFreePredictionAgent):
     """
     Agent that runs the MC prediction algorithm
     """
-    def __init__(self, env, discount = 0.9, policy = None):
+    def __init__(self, env, discount = 0.9, policy = None, firstVisit = False):
         """
-        env: Environment of the agent
+        env: Environment of the agent, a GridworldEnvironment
         discount: The discount factor. Should actually be part of the mdp but this implementation makes the agent select it
         policy: The (initial or to be evaluated) policy of the agent
+        firstVisit: Use first-visit instead of every-visit MC
         """
         super().__init__(env, discount, policy)
         self.visitCount = util.Counter()
         self.numEpisodes = 0
+        self.firstVisit = firstVisit
+        self.episodeBuffer = EpisodeBuffer()
         
         if policy:
             self.policy = policy
         else:
             self.policy = policies.RandomPolicy(self)
         
-    def _doOneEpisode(self):
-        """
-        This runs a single episode on the environment with the given policy
-        """
-        transitionList = []
-        currentState = self.env.getCurrentState()
-        while True:
-            action = self.policy(currentState)
-            nextState, reward = self.takeAction(action)
-            transitionList.append((currentState,action,reward))
-            if self.isTerminal(nextState):
-                break
-            currentState = nextState
-        return transitionList
-    
     def run(self):
         """
-        Every-visit MC prediction algorithm for one episode.
+        Every-visit (or first-visit) MC prediction algorithm for one episode.
         Doesn't need to return anything special
         """
         
         self.newEpisode()
+        model = self.env.gridWorld.compile()
+
+        # Run one episode, the returns G(i-1) = R(i-1) + gamma*G(i) are computed in one backward scan
+        buffer = _recordEpisode(self, model, self.policy)
+        returns = buffer.getReturns(self.discount)
+        self._mergeReturns(model, *accumulateReturns(buffer.getStates(), returns, self.firstVisit))
+
+        return self.values
 
-        # Run one episode and get transitions
-        # Transitions are a list of state,action,reward tuples
-        transitionList = self._doOneEpisode()
+    def _mergeReturns(self, model, states, returnSums, visitCounts):
+        """
+        Adds return sums and visit counts of the given state indices to the running averages 
+        in self.values and self.visitCount
+        """
+        for s, returnSum, count in zip(states.tolist(), returnSums.tolist(), visitCounts.tolist()):
+            state = model.states[s]
+            oldCount = self.visitCount[state]
+            newCount = oldCount + count
+            self.values[state] = (self.values[state]*oldCount + returnSum)/newCount
+            self.visitCount[state] = newCount
 
-        # Reverse due to the backward recursive definition, do not want to keep extra memory:
-        # G(i-1) = R(i-1) + gamma*G(i), G(end) = R(end)
-        transitionList.reverse()
+    def runParallel(self, numEpisodes, numWorkers = None, seed = None):
+        """
+        Every-visit (or first-visit) MC prediction over numEpisodes episodes from the start state, 
+        split over numWorkers processes (os.cpu_count() if None). 
+        Each worker gets its own random stream spawned from seed and returns per-state
+        return sums and visit counts, which are merged into self.values and self.visitCount.
+        The environment must be a GridworldEnvironment and the policy must not change during the episodes.
+        """
+        gridWorld = self.env.gridWorld
+        model = gridWorld.compile()
+        policyProbs = self.policy.getProbabilityArray(model)
+        counts, seeds = baseAgents.splitEpisodes(numEpisodes, numWorkers, seed)
 
-        currentReturn = 0
-        for transition in transitionList:
-            state, action, reward = transition
-            # Increment the visit count
-            self.visitCount.increment(state)
-            # Update the return
-            currentReturn = reward + self.discount*currentReturn
-            # Update the value
-            self.values[state] +=  1./self.visitCount[state]*(currentReturn - self.values[state])
+        returnSums = np.zeros(model.numStates)
+        visitCounts = np.zeros(model.numStates, dtype=np.int64)
+        with ProcessPoolExecutor(max_workers = len(counts)) as executor:
+            futures = [executor.submit(_runEpisodes, gridWorld, policyProbs, self.discount, count, seedSequence, self.firstVisit)
+                       for count, seedSequence in zip(counts, seeds)]
+            for future in futures:
+                workerStates, workerSums, workerCounts = future.result()
+                returnSums[workerStates] += workerSums
+                visitCounts[workerStates] += workerCounts
 
+        visited = np.flatnonzero(visitCounts)
+        self._mergeReturns(model, visited, returnSums[visited], visitCounts[visited])
+        self.numEpisodes += numEpisodes
         return self.values
 
 class MonteCarloControlAgent(baseAgents.BaseModelFreeControlAgent):
-    def __init__(self, env, discount = 0.9,  epsilon = 0.3, policy = None, epsilonScheduler = None):
-        super().__init__(env, discount, epsilon, epsilonScheduler = epsilonScheduler)
+    updatesEpsilonPerEpisode = False
+
+    def __init__(self, env, discount = 0.9,  epsilon = 0.3, policy = None, epsilonScheduler = None, batchSize = 1):
         """
-        env: Environment of the agent
+        env: Environment of the agent, a GridworldEnvironment
         discount: The discount factor. Should actually be part of the mdp but this implementation makes the agent select it
         policy: The (initial or to be evaluated) policy of the agent
         epsilon: The initial epsilon value for epsilon greedy action selection
-        epsilonScheduler: The epsilon scheduler that will update the epsilon value after each episode. 
+        epsilonScheduler: The epsilon scheduler that will update the epsilon value before each batch of episodes,
+            so the k-th batch runs with its k-th value however the episodes are run.
+            A parameterSchedulers.GlieScheduler if not given, so that the policy becomes greedy in the limit
+        batchSize: The number of episodes whose returns are collected before the q-values (and so the policy) are updated
         """
+        if epsilonScheduler is None:
+            epsilonScheduler = parameterSchedulers.GlieScheduler(epsilon)
+        super().__init__(env, discount, epsilon = epsilon, epsilonScheduler = epsilonScheduler)
         
         self.visitCount = util.Counter()
+        self.batchSize = batchSize
+        self.episodeBuffer = EpisodeBuffer()
+        self._pending = []
+        
+        # Greedy with respect to the q-values, episodes are run epsilon-greedily with it
+        self.policy = policies.PolicyFromQValues(self)
+
+    def run(self):
         """
-        You can add your own fields. 
+        Every-visit MC control for one episode. 
+        The returns are kept until batchSize episodes are collected and then averaged into self.qvalues at once.
         """
-        
-        #You need to pick the correct policy! Set the below field to the correct one
-        self.policy = None
-        
+        if not self._pending:
+            self.updateEpsilon()
+        self.newEpisode()
+        model = self.env.gridWorld.compile()
+        buffer = _recordEpisode(self, model, self.getEpsilonGreedyAction)
+        keys = buffer.getStates()*model.numActions + buffer.getActions()
+        self._pending.append(accumulateReturns(keys, buffer.getReturns(self.discount)))
+        if len(self._pending) >= self.batchSize:
+            self.update()
+        return self.qvalues
+
+    def runBatch(self, numEpisodes, numWorkers = None, seed = None):
+        """
+        Runs numEpisodes epsilon-greedy episodes from the start state in numWorkers processes 
+        (os.cpu_count() if None), each with its own random stream spawned from seed, 
+        and then updates the q-values with all of them. Epsilon is updated once for the batch.
+        """
+        if not self._pending:
+            self.updateEpsilon()
+        self.numEpisodes += numEpisodes
+        gridWorld = self.env.gridWorld
+        model = gridWorld.compile()
+        policyProbs = self._getBehaviourProbs(model)
+        counts, seeds = baseAgents.splitEpisodes(numEpisodes, numWorkers, seed)
+        with ProcessPoolExecutor(max_workers = len(counts)) as executor:
+            futures = [executor.submit(_runEpisodes, gridWorld, policyProbs, self.discount, count, seedSequence, False, True)
+                       for count, seedSequence in zip(counts, seeds)]
+            for future in futures:
+                self._pending.append(future.result())
+        self.update()
+        return self.qvalues
+
+    def update(self):
+        """
+        Averages the collected returns into self.qvalues and self.visitCount in bulk
+        """
+        if not self._pending:
+            return
+        model = self.env.gridWorld.compile()
+        keys = np.concatenate([pending[0] for pending in self._pending])
+        returnSums = np.concatenate([pending[1] for pending in self._pending])
+        visitCounts = np.concatenate([pending[2] for pending in self._pending])
+        self._pending = []
+        keys, inverse = np.unique(keys, return_inverse=True)
+        returnSums = np.bincount(inverse, weights=returnSums, minlength=len(keys))
+        visitCounts = np.bincount(inverse, weights=visitCounts, minlength=len(keys)).astype(np.int64)
+        for key, returnSum, count in zip(keys.tolist(), returnSums.tolist(), visitCounts.tolist()):
+            s, a = divmod(key, model.numActions)
+            stateAction = (model.states[s], model.actions[a])
+            oldCount = self.visitCount[stateAction]
+            newCount = oldCount + count
+            self.qvalues[stateAction] = (self.qvalues[stateAction]*oldCount + returnSum)/newCount
+            self.visitCount[stateAction] = newCount
+
+    def _getBehaviourProbs(self, model):
+        """
+        Returns the epsilon-greedy pi(a|s) of the current q-values as a (numStates, numActions) array
+        """
+        return _epsilonGreedyProbs(self.qvalues, model, self.epsilon)
+
+class OffPolicyMonteCarloAgent(baseAgents.BaseModelFreeControlAgent):
     """
-    You can add your own functions
+    Off-policy every-visit MC with weighted importance sampling.
+    Episodes are generated with a fixed behaviour policy and stored, the q-values of the target policy 
+    are then estimated from them with the cumulative weights C(s,a). 
+    The same episodes can be used to evaluate any number of other target policies with evaluate.
     """
+    def __init__(self, env, discount = 0.9, behaviourPolicy = None, policy = None):
+        """
+        env: Environment of the agent, a GridworldEnvironment
+        discount: The discount factor. Should actually be part of the mdp but this implementation makes the agent select it
+        behaviourPolicy: The policy that generates the episodes, a policies.RandomPolicy if not given.
+            It must give nonzero probability to every action the target policies can take
+        policy: The target policy to evaluate. If not given, the target policy is greedy with respect to 
+            the q-values and the agent does off-policy MC control
+        """
+        super().__init__(env, discount)
+        if behaviourPolicy is None:
+            behaviourPolicy = policies.RandomPolicy(self)
+        self.behaviourPolicy = behaviourPolicy
+        self.isControl = policy is None
+        if self.isControl:
+            policy = policies.PolicyFromQValues(self)
+        self.policy = policy
         
+        self.cumulativeWeights = util.Counter()
+        self.episodeBuffer = EpisodeBuffer()
+        self.behaviourProbs = None
+        self.numMerged = 0
+
+    def generateEpisodes(self, numEpisodes):
+        """
+        Runs numEpisodes episodes on the environment with the behaviour policy and adds them to self.episodeBuffer
+        """
+        model = self.env.gridWorld.compile()
+        if self.behaviourProbs is None:
+            self.behaviourProbs = self.behaviourPolicy.getProbabilityArray(model)
+            self._behaviourCumProbs = np.cumsum(self.behaviourProbs, axis=1).tolist()
+        buffer = self.episodeBuffer
+        for _ in range(numEpisodes):
+            self.newEpisode()
+            self.env.reset()
+            currentState = self.env.getCurrentState()
+            while True:
+                s = model.stateIndex[currentState]
+                cumProbs = self._behaviourCumProbs[s]
+                a = min(bisect.bisect_right(cumProbs, random.random()*cumProbs[-1]), model.numActions - 1)
+                nextState, reward = self.takeAction(model.actions[a])
+                buffer.append(s, a, reward)
+                if self.isTerminal(nextState):
+                    break
+                currentState = nextState
+            buffer.endEpisode()
 
     def run(self):
-        self.newEpisode()
-        util.raiseNotDefined()
-        """
-        Comment out the previous line and write your code here.
-        You need to implement every-visit MC control algorithm for one episode
-        After this method is run, self.qvalues must be filled with the updated q-values
-        Make sure to look at policies.PolicyFromQValues and the BaseModelFreeValueControlAlgo
-        Feel free to add new methods
-        Feel free to look at the prediction version
-        Note that you need to implement the do one episode that is using your chosen policy
-        Doesn't need to return anything special
-        
-        return value is not important
-        """ 
+        """
+        Generates one episode with the behaviour policy and updates the q-values of the target policy with it
+        """
+        self.generateEpisodes(1)
+        self.update()
+        return self.qvalues
+
+    def update(self):
+        """
+        Merges the stored episodes that are not used yet into self.qvalues and self.cumulativeWeights.
+        In control, the target policy is the greedy policy of the q-values before the update.
+        """
+        model = self.env.gridWorld.compile()
+        if self.isControl:
+            targetProbs = _epsilonGreedyProbs(self.qvalues, model, 0.0)
+        else:
+            targetProbs = self.policy.getProbabilityArray(model)
+        keys, weightSums, weightedReturnSums = self._getWeightedReturns(model, targetProbs, self.numMerged)
+        self.numMerged = self.episodeBuffer.length
+        self._mergeWeightedReturns(model, self.qvalues, self.cumulativeWeights, keys, weightSums, weightedReturnSums)
+        return self.qvalues
+
+    def evaluate(self, policy):
+        """
+        Returns the weighted importance sampling estimate of the q-values of the given target policy 
+        from all stored episodes, as a util.Counter. The agent's own q-values are not changed.
+        """
+        model = self.env.gridWorld.compile()
+        qvalues = util.Counter()
+        keys, weightSums, weightedReturnSums = self._getWeightedReturns(model, policy.getProbabilityArray(model))
+        self._mergeWeightedReturns(model, qvalues, util.Counter(), keys, weightSums, weightedReturnSums)
+        return qvalues
 
-        #return self.qvalues
+    def _getWeightedReturns(self, model, targetProbs, start = 0):
+        """
+        Computes the importance weights W(t) = prod(pi(a|s)/b(a|s)) of the steps after t in each stored episode,
+        starting from the step index start (an episode start).
+        Returns the visited keys state*numActions + action with their sums of W and W*G
+        """
+        buffer = self.episodeBuffer
+        episodeStarts = [i - start for i in buffer.episodeStarts if i >= start]
+        states = buffer.getStates()[start:]
+        actions = buffer.getActions()[start:]
+        if len(states) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+        returns = discountedReturns(buffer.getRewards()[start:], self.discount, episodeStarts)
+        ratios = targetProbs[states, actions]/self.behaviourProbs[states, actions]
+        weights = _suffixProducts(ratios, episodeStarts)
+        used = weights > 0
+        keys, inverse = np.unique(states[used]*model.numActions + actions[used], return_inverse=True)
+        weightSums = np.bincount(inverse, weights=weights[used], minlength=len(keys))
+        weightedReturnSums = np.bincount(inverse, weights=weights[used]*returns[used], minlength=len(keys))
+        return keys, weightSums, weightedReturnSums
+
+    def _mergeWeightedReturns(self, model, qvalues, cumulativeWeights, keys, weightSums, weightedReturnSums):
+        """
+        Q(s,a) <- Q(s,a) + (sum(W*G) - sum(W)*Q(s,a))/C(s,a), the batched form of the incremental update
+        """
+        for key, weightSum, weightedReturnSum in zip(keys.tolist(), weightSums.tolist(), weightedReturnSums.tolist()):
+            s, a = divmod(key, model.numActions)
+            stateAction = (model.states[s], model.actions[a])
+            cumulativeWeights[stateAction] += weightSum
+            qvalues[stateAction] += (weightedReturnSum - weightSum*qvalues[stateAction])/cumulativeWeights[stateAction]
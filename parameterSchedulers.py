@@ -39,4 +39,21 @@ class NoneScheduler():
         return self.param
 
 
+class GlieScheduler():
+    """
+    Decays the parameter as initialValue/k after the k-th update. 
+    Used for epsilon, it goes to zero while its sum diverges, so every state-action pair keeps 
+    being explored (Greedy in the Limit with Infinite Exploration)
+    """
+    def __init__(self, initialValue):
+        self.initVal = initialValue
+        self.param = initialValue
+        self.numUpdates = 0
+
+    def update(self):
+        self.numUpdates += 1
+        self.param = self.initVal/self.numUpdates
+        return self.param
+
+
 # Add your own class here if you want to use this
@@ -30,6 +30,8 @@ AUTHORS: Baris Akgun
 """
 
 import random, util, math
+import tables
+import numpy as np
 
 class BasePolicy():
     """
@@ -63,6 +65,47 @@ class BasePolicy():
         """
         pass
 
+    def getProbabilityArray(self, model):
+        """
+        Returns pi(a|s) as a (numStates, numActions) array in the order of a compiled model 
+        (see gridworld.Gridworld.compile), using policyProbs. States without actions have all zeros.
+        """
+        pi = np.zeros((model.numStates, model.numActions))
+        for s in np.flatnonzero(model.legalActions.any(axis=1)).tolist():
+            for action, prob in self.policyProbs(model.states[s]).items():
+                if action in model.actionIndex:
+                    pi[s, model.actionIndex[action]] = prob
+        pi[~model.legalActions] = 0.0
+        return pi
+
+    def sample(self, states, rng, epsilon = 0.0, model = None):
+        """
+        Returns epsilon-greedy actions for a vector of states in one go.
+        states: State indices of a compiled model (see gridworld.Gridworld.compile)
+        rng: A numpy.random.Generator
+        epsilon: The chance of taking a uniformly random legal action instead of the greedy one
+        model: The compiled model, the one of the agent's environment if None
+        Returns the action indices (model.actions[a] is the action), -1 for states without actions
+        """
+        if model is None:
+            model = self.agent.env.gridWorld.compile()
+        states = np.asarray(states, dtype=np.int64)
+        legal = model.legalActions[states]
+        actions = self.getGreedyIndices(states, rng, model)
+        if epsilon > 0:
+            explore = rng.random(len(states)) < epsilon
+            if explore.any():
+                actions[explore] = _randomArgMax(np.where(legal[explore], 0.0, -np.inf), rng)
+        actions[~legal.any(axis=1)] = -1
+        return actions
+
+    def getGreedyIndices(self, states, rng, model):
+        """
+        Returns the greedy action indices of a vector of state indices, see sample.
+        This calls greedyAction state by state, the subclasses override it with array operations
+        """
+        return np.array([model.actionIndex.get(self.greedyAction(model.states[s]), -1) for s in states.tolist()], dtype=np.int64)
+
     def epsilonGreedyAction(self, state, epsilon = -1):
         #Do not change the if statement
         if(epsilon < 0):
@@ -77,7 +120,7 @@ class BasePolicy():
         - Look at the self.agent.getPossibleActions function for all possible actions
         """
 
-        actions = self.mdp.getPossibleActions(state)
+        actions = self.agent.getPossibleActions(state)
         if random.random() < epsilon:
             return random.choice(actions)
         else:
@@ -112,7 +155,14 @@ class BasePolicy():
         Allows us to call state in policy
         Only works when the agent has an mdp field!
         """
-        return key in self.agent.mdp.getStates() 
+        return key in self.agent.mdp.getStateIndex()
+
+def _randomArgMax(values, rng):
+    """
+    Returns the argmax of each row of values, breaking ties uniformly at random with noise
+    """
+    isMax = values == values.max(axis=1, keepdims=True)
+    return np.where(isMax, rng.random(values.shape), -1.0).argmax(axis=1)
 
 class RandomPolicy(BasePolicy):
     """
@@ -132,6 +182,9 @@ class RandomPolicy(BasePolicy):
             probs[action] = 1/len(actions)
         return probs
 
+    def getGreedyIndices(self, states, rng, model):
+        return _randomArgMax(np.where(model.legalActions[states], 0.0, -np.inf), rng)
+
 class SingleActionPolicy(BasePolicy):
     """
     Policy that always selects the given action or the first action if the given action is not legal
@@ -156,6 +209,13 @@ class SingleActionPolicy(BasePolicy):
             probs[actions[0]] = 1.0
         return probs
 
+    def getGreedyIndices(self, states, rng, model):
+        legal = model.legalActions[states]
+        a = model.actionIndex.get(self.action)
+        if a is None:
+            return legal.argmax(axis=1)
+        return np.where(legal[:, a], a, legal.argmax(axis=1))
+
 class TabularPolicy(BasePolicy):
     """
     Representation of the tabular policy. 
@@ -166,6 +226,8 @@ class TabularPolicy(BasePolicy):
         if not policyTable:
             policyTable = {}
         self.policyTable = policyTable
+        self._actionIndices = None
+        self._indexedModel = None
         for state in list(self.agent.values.keys()):
             if state not in self.policyTable.keys():
                 if self.agent.isTerminal(state):
@@ -182,9 +244,26 @@ class TabularPolicy(BasePolicy):
         probs = util.Counter()
         probs[self.policyTable[state]] = 1.0
         return probs
+
+    def getGreedyIndices(self, states, rng, model):
+        """
+        The policy table is turned into an array of action indices once, policy[state] = action keeps it current.
+        Call self.refreshIndices() after changing self.policyTable directly.
+        """
+        if self._actionIndices is None or self._indexedModel is not model:
+            self._actionIndices = np.array([model.actionIndex.get(self.policyTable.get(state), -1) for state in model.states], dtype=np.int64)
+            self._indexedModel = model
+        return self._actionIndices[states]
+
+    def refreshIndices(self):
+        self._actionIndices = None
         
     def __setitem__(self,state,action):
         self.policyTable[state] = action
+        if self._actionIndices is not None:
+            s = self._indexedModel.stateIndex.get(state)
+            if s is not None:
+                self._actionIndices[s] = self._indexedModel.actionIndex.get(action, -1)
 
 class PolicyFromQValues(BasePolicy):
     """
@@ -207,6 +286,8 @@ class PolicyFromQValues(BasePolicy):
         """
         if self.agent.isTerminal(state):
             return None
+        if isinstance(self.agent.qvalues, tables.QTable):
+            return self.agent.qvalues.getGreedyAction(state)
         qVals = self.agent.getActionValuesGivenState(state)
         maxVal = -math.inf
         argMaxAct = None
@@ -225,4 +306,18 @@ class PolicyFromQValues(BasePolicy):
         probs[self.greedyAction(state)] = 1.0
         return probs
 
+    def getGreedyIndices(self, states, rng, model):
+        """
+        Ties are broken at random, unlike greedyAction which takes the first maximizing action
+        """
+        qvalues = self.agent.qvalues
+        legal = model.legalActions[states]
+        if isinstance(qvalues, tables.QTable):
+            Q = qvalues.array[states]
+        else:
+            Q = np.zeros(legal.shape)
+            for i, a in zip(*np.nonzero(legal)):
+                Q[i, a] = qvalues[(model.states[states[i]], model.actions[a])]
+        return _randomArgMax(np.where(legal, Q, -np.inf), rng)
+
        
\ No newline at end of file
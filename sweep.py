@@ -0,0 +1,247 @@
+"""
+Runs a grid of configurations (algorithm, grid, discount, noise, living reward, epsilon) headlessly
+in a process pool and streams one row per configuration to a CSV file as the runs finish.
+
+Example:
+    python sweep.py -a qi,vqi,ql -g BookGrid,MazeGrid -n 0.0,0.2,0.4 -r 0,-0.1 -k 200 -o results.csv
+
+Each configuration runs in a worker process with its own random seed, without any display or PNG.
+The columns are the configuration followed by the results: the iterations (or episodes) returned by the
+agent, the wall time of the run, the environment steps, the episodes cut at the step limit, the mean 
+undiscounted return per episode (model free agents only), the value of the start state and the mean 
+value over all states.
+"""
+
+import csv
+import itertools
+import optparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import gridworld
+import dpAgents, mcAgents, tdAgents
+
+DP_ALGOS = ('pe', 'qi', 'vqi', 'ps', 'pi')
+EPISODE_ALGOS = ('mcp', 'mcc', 'mco', 'td', 'ntd', 'tdl', 'sr', 'ql', 'esr', 'dql', 'dq')
+
+CONFIG_COLUMNS = ['algo', 'grid', 'discount', 'noise', 'livingReward', 'epsilon', 'episodes', 'iters', 'maxSteps', 'seed']
+RESULT_COLUMNS = ['iterations', 'wallTime', 'steps', 'truncated', 'meanReturn', 'startValue', 'meanValue', 'error']
+
+class RecordingEnvironment(gridworld.GridworldEnvironment):
+    """
+    GridworldEnvironment without callbacks that counts the steps and sums the rewards it hands out
+    """
+    def __init__(self, gridWorld):
+        super().__init__(gridWorld)
+        self.numSteps = 0
+        self.totalReward = 0.0
+
+    def doAction(self, action):
+        nextState, reward = super().doAction(action)
+        self.numSteps += 1
+        self.totalReward += reward
+        return nextState, reward
+
+def makeAgent(config, mdp, env):
+    """
+    Returns the agent of config['algo'], set up like main.py does
+    """
+    algo, discount, epsilon = config['algo'], config['discount'], config['epsilon']
+    if algo == 'pe':
+        agent = dpAgents.PolicyEvaluationAgent(mdp, env, discount, None, 0.001, config['iters'])
+    elif algo == 'qi':
+        agent = dpAgents.QValueIterationAgent(mdp, env, discount, maxIters = config['iters'])
+    elif algo == 'vqi':
+        agent = dpAgents.VectorizedQValueIterationAgent(mdp, env, discount, maxIters = config['iters'])
+    elif algo == 'ps':
+        agent = dpAgents.PrioritizedSweepingAgent(mdp, env, discount, maxIters = config['iters'])
+    elif algo == 'pi':
+        agent = dpAgents.PolicyIterationAgent(mdp, env, discount = discount, maxPolicyIters = config['iters'])
+    elif algo == 'mcp':
+        agent = mcAgents.MonteCarloPredictionAgent(env, discount = discount)
+    elif algo == 'mcc':
+        agent = mcAgents.MonteCarloControlAgent(env, discount = discount, epsilon = epsilon)
+    elif algo == 'mco':
+        agent = mcAgents.OffPolicyMonteCarloAgent(env, discount = discount)
+    elif algo == 'td':
+        agent = tdAgents.TemporalDifferencePredictionAgent(env, discount = discount)
+    elif algo == 'ntd':
+        agent = tdAgents.NStepTDPredictionAgent(env, discount = discount)
+    elif algo == 'tdl':
+        agent = tdAgents.TDLambdaPredictionAgent(env, discount = discount)
+    elif algo == 'sr':
+        agent = tdAgents.SarsaAgent(env, discount = discount, epsilon = epsilon)
+    elif algo == 'ql':
+        agent = tdAgents.QLearningAgent(env, discount = discount, epsilon = epsilon)
+    elif algo == 'esr':
+        agent = tdAgents.ExpectedSarsaAgent(env, discount = discount, epsilon = epsilon)
+    elif algo == 'dql':
+        agent = tdAgents.DoubleQLearningAgent(env, discount = discount, epsilon = epsilon)
+    elif algo == 'dq':
+        agent = tdAgents.DynaQAgent(env, discount = discount, epsilon = epsilon)
+    else:
+        raise Exception(f"Unknown algorithm {algo}!")
+    agent.getPossibleActions = mdp.getPossibleActions
+    agent.isTerminal = mdp.isTerminal
+    return agent
+
+def runAgent(agent, algo, env, episodes, maxSteps):
+    """
+    Runs the agent the way main.py does. 
+    The step by step agents stop an episode after maxSteps steps, the Monte Carlo agents always finish theirs.
+    Returns the iterations (DP) or episodes and the number of episodes that were cut at maxSteps
+    """
+    if algo in DP_ALGOS:
+        return agent.run(), 0
+    if algo == 'mco':
+        agent.generateEpisodes(episodes)
+        agent.update()
+        return episodes, 0
+    truncated = 0
+    for _ in range(episodes):
+        env.reset()
+        if algo in ('mcp', 'mcc'):
+            agent.run()
+            continue
+        agent.newEpisode()
+        steps = 0
+        while agent.run():
+            steps += 1
+            if steps >= maxSteps:
+                truncated += 1
+                break
+    if algo == 'mcc':
+        agent.update()
+    return episodes, truncated
+
+def _getStateValues(agent, mdp):
+    """
+    Returns V(s) for every state, max_a Q(s,a) for the agents that learn q-values
+    """
+    states = mdp.getStateIndex().states
+    if len(agent.getQValues()) == 0 or isinstance(agent, dpAgents.QValueIterationAgent):
+        values = agent.getValues()
+        return [values[state] for state in states]
+    return [max((agent.getQValue(state, action) for action in mdp.getPossibleActions(state)), default = 0.0)
+            for state in states]
+
+def runConfiguration(config):
+    """
+    Runs a single configuration (a dictionary with the CONFIG_COLUMNS) and returns its results as a dictionary
+    with the CONFIG_COLUMNS and RESULT_COLUMNS. Exceptions are reported in the error column.
+    """
+    result = dict(config)
+    try:
+        random.seed(config['seed'])
+        mdp = getattr(gridworld, 'get' + config['grid'])()
+        mdp.setLivingReward(config['livingReward'])
+        mdp.setNoise(config['noise'])
+        mdp.setDiscount(config['discount'])
+        env = RecordingEnvironment(mdp)
+        agent = makeAgent(config, mdp, env)
+
+        startTime = time.perf_counter()
+        iterations, truncated = runAgent(agent, config['algo'], env, config['episodes'], config['maxSteps'])
+        result['wallTime'] = time.perf_counter() - startTime
+
+        values = _getStateValues(agent, mdp)
+        result['iterations'] = iterations
+        result['steps'] = env.numSteps
+        result['truncated'] = truncated
+        result['meanReturn'] = env.totalReward/config['episodes'] if config['algo'] in EPISODE_ALGOS else ''
+        result['startValue'] = values[mdp.getStateIndex().index[mdp.getStartState()]]
+        result['meanValue'] = sum(values)/len(values)
+        result['error'] = ''
+    except Exception as e:
+        for column in RESULT_COLUMNS:
+            result.setdefault(column, '')
+        result['error'] = repr(e)
+    return result
+
+def getConfigurations(opts):
+    """
+    Returns the cartesian product of the comma separated option lists as configuration dictionaries,
+    each with its own seed
+    """
+    configs = []
+    product = itertools.product(opts.algos.split(','), opts.grids.split(','), _floats(opts.discounts),
+                                _floats(opts.noises), _floats(opts.livingRewards), _floats(opts.epsilons))
+    for i, (algo, grid, discount, noise, livingReward, epsilon) in enumerate(product):
+        configs.append({'algo': algo, 'grid': grid, 'discount': discount, 'noise': noise, 'livingReward': livingReward,
+                        'epsilon': epsilon, 'episodes': opts.episodes, 'iters': opts.iters, 'maxSteps': opts.maxSteps,
+                        'seed': opts.seed + i})
+    return configs
+
+def _floats(values):
+    return [float(value) for value in values.split(',')]
+
+def parseOptions(argv = None):
+    optParser = optparse.OptionParser(usage = 'python sweep.py [options], list options take comma separated values')
+    optParser.add_option('-a', '--agents',action='store',
+                         type='string',dest='algos',default='qi',
+                         help='Agents to run, see main.py (options are ' + ', '.join(DP_ALGOS + EPISODE_ALGOS) + ', default %default)')
+    optParser.add_option('-g', '--grids',action='store',
+                         type='string',dest='grids',default='BookGrid',
+                         help='Grids to use (default %default)')
+    optParser.add_option('-d', '--discounts',action='store',
+                         type='string',dest='discounts',default='0.9',
+                         help='Discounts (default %default)')
+    optParser.add_option('-n', '--noises',action='store',
+                         type='string',dest='noises',default='0.2',
+                         help='Noises (default %default)')
+    optParser.add_option('-r', '--livingRewards',action='store',
+                         type='string',dest='livingRewards',default='0.0',
+                         help='Living rewards (default %default)')
+    optParser.add_option('-e', '--epsilons',action='store',
+                         type='string',dest='epsilons',default='0.3',
+                         help='Epsilons of the epsilon-greedy agents (default %default)')
+    optParser.add_option('-k', '--episodes',action='store',
+                         type='int',dest='episodes',default=100,
+                         help='Number of episodes for RL methods (default %default)')
+    optParser.add_option('-i', '--iterations',action='store',
+                         type='int',dest='iters',default=100,
+                         help='Maximum number of iterations for DP methods (default %default)')
+    optParser.add_option('-m', '--maxSteps',action='store',
+                         type='int',dest='maxSteps',default=10000,
+                         help='Maximum number of steps of an episode of the TD agents, the longer episodes are cut (default %default)')
+    optParser.add_option('-s', '--seed',action='store',
+                         type='int',dest='seed',default=123456,
+                         help='Seed of the first configuration, the next ones count up from it (default %default)')
+    optParser.add_option('-w', '--workers',action='store',
+                         type='int',dest='workers',default=os.cpu_count(),
+                         help='Number of worker processes (default %default)')
+    optParser.add_option('-o', '--output',action='store',
+                         type='string',dest='output',default='sweep.csv',
+                         help='CSV file to write the results to, - for stdout (default %default)')
+    opts, args = optParser.parse_args(argv)
+    return opts
+
+def runSweep(configs, output, numWorkers = None):
+    """
+    Runs the configurations in a process pool and writes each result row to the open file output as soon as it finishes.
+    Returns the number of failed configurations
+    """
+    writer = csv.DictWriter(output, fieldnames = CONFIG_COLUMNS + RESULT_COLUMNS)
+    writer.writeheader()
+    numFailed = 0
+    with ProcessPoolExecutor(max_workers = numWorkers) as executor:
+        futures = [executor.submit(runConfiguration, config) for config in configs]
+        for future in as_completed(futures):
+            result = future.result()
+            numFailed += result['error'] != ''
+            writer.writerow(result)
+            output.flush()
+    return numFailed
+
+if __name__ == '__main__':
+    opts = parseOptions()
+    configs = getConfigurations(opts)
+    if opts.output == '-':
+        numFailed = runSweep(configs, sys.stdout, opts.workers)
+    else:
+        with open(opts.output, 'w', newline='') as output:
+            numFailed = runSweep(configs, output, opts.workers)
+        print("FINISHED %d CONFIGURATIONS (%d FAILED), RESULTS IN %s" % (len(configs), numFailed, opts.output))
@@ -0,0 +1,187 @@
+"""
+Dense, array backed tables for the agents.
+
+The tables keep the (state, action) mapping interface of the util.Counter objects used by the agents,
+so they can be passed to the displays and main.py as they are, while the vectorized code works
+on the underlying numpy array directly.
+"""
+
+import numpy as np
+
+class QTable:
+    """
+    Q(s,a) stored in a float64[numStates, numActions] array.
+    Rows follow the given state order and columns the given action order.
+
+    qtable[(state, action)] reads and writes the array. Unlike util.Counter, reading a
+    pair that is not in the table returns 0.0 without adding it, and writing one raises a KeyError.
+    The mapping methods (keys, items, len, ...) only cover the legal (state, action) pairs.
+
+    The table also caches the greedy (first maximizing legal) action and the max value of every state.
+    The cache is built on the first greedy lookup and kept up to date by the writes through 
+    qtable[(state, action)] and setValue. Code that writes self.array directly must call refreshGreedy.
+    """
+    def __init__(self, states, actions, legalActions = None, array = None):
+        """
+        states: The states, in row order
+        actions: The actions, in column order
+        legalActions: Boolean array of the legal (state, action) pairs, all pairs if None
+        array: The array to use instead of a new zero array, it is not copied
+        """
+        self.states = list(states)
+        self.stateIndex = {state: i for i, state in enumerate(self.states)}
+        self.actions = tuple(actions)
+        self.actionIndex = {action: a for a, action in enumerate(self.actions)}
+        shape = (len(self.states), len(self.actions))
+        if legalActions is None:
+            legalActions = np.ones(shape, dtype=bool)
+        self.legalActions = legalActions
+        if array is None:
+            array = np.zeros(shape)
+        self.array = array
+        self.hasActions = self.legalActions.any(axis=1).tolist()
+        self._greedyActions = None
+        self._maxValues = None
+
+    @classmethod
+    def fromModel(cls, model, array = None):
+        """
+        Returns a QTable over the states and actions of a compiled model (see gridworld.Gridworld.compile)
+        """
+        return cls(model.states, model.actions, model.legalActions, array)
+
+    def index(self, state, action):
+        """
+        Returns the (row, column) of (state, action), None if it is not in the table
+        """
+        s = self.stateIndex.get(state)
+        a = self.actionIndex.get(action)
+        if s is None or a is None:
+            return None
+        return s, a
+
+    def getActionValues(self, state):
+        """
+        Returns the row Q(state,.) of the array, None if the state is not in the table
+        """
+        s = self.stateIndex.get(state)
+        if s is None:
+            return None
+        return self.array[s]
+
+    def __getitem__(self, key):
+        s = self.stateIndex.get(key[0])
+        a = self.actionIndex.get(key[1])
+        if s is None or a is None:
+            return 0.0
+        return float(self.array[s, a])
+
+    def __setitem__(self, key, value):
+        index = self.index(*key)
+        if index is None:
+            raise KeyError(key)
+        self.setValue(index[0], index[1], value)
+
+    def setValue(self, s, a, value):
+        """
+        Writes Q(s,a) by row and column index and updates the greedy cache of row s
+        """
+        self.array[s, a] = value
+        if self._greedyActions is None or not self.legalActions[s, a]:
+            return
+        best = self._greedyActions[s]
+        if value > self._maxValues[s] or (value == self._maxValues[s] and a < best):
+            self._greedyActions[s] = a
+            self._maxValues[s] = float(value)
+        elif a == best:
+            self._refreshRow(s)
+
+    def getGreedyIndex(self, s):
+        """
+        Returns the column of the greedy action of row s, None if the row has no legal actions
+        """
+        if not self.hasActions[s]:
+            return None
+        if self._greedyActions is None:
+            self.refreshGreedy()
+        return self._greedyActions[s]
+
+    def getMaxValue(self, s):
+        """
+        Returns the largest legal value of row s, 0.0 if the row has no legal actions
+        """
+        if not self.hasActions[s]:
+            return 0.0
+        if self._greedyActions is None:
+            self.refreshGreedy()
+        return self._maxValues[s]
+
+    def getGreedyAction(self, state):
+        """
+        Returns the greedy action of the state, None if it has no legal actions or is not in the table
+        """
+        s = self.stateIndex.get(state)
+        if s is None:
+            return None
+        a = self.getGreedyIndex(s)
+        if a is None:
+            return None
+        return self.actions[a]
+
+    def refreshGreedy(self, rows = None):
+        """
+        Recomputes the greedy cache of the given rows, or of all rows if None
+        """
+        if rows is None or self._greedyActions is None:
+            masked = np.where(self.legalActions, self.array, -np.inf)
+            self._greedyActions = masked.argmax(axis=1).tolist()
+            self._maxValues = masked.max(axis=1).tolist()
+            return
+        for s in np.unique(rows).tolist():
+            self._refreshRow(s)
+
+    def _refreshRow(self, s):
+        if not self.hasActions[s]:
+            return
+        masked = np.where(self.legalActions[s], self.array[s], -np.inf)
+        best = int(masked.argmax())
+        self._greedyActions[s] = best
+        self._maxValues[s] = float(masked[best])
+
+    def get(self, key, default = None):
+        if key in self:
+            return self[key]
+        return default
+
+    def __contains__(self, key):
+        index = self.index(*key)
+        return index is not None and bool(self.legalActions[index])
+
+    def keys(self):
+        states, actions = np.nonzero(self.legalActions)
+        return [(self.states[s], self.actions[a]) for s, a in zip(states.tolist(), actions.tolist())]
+
+    def values(self):
+        return self.array[self.legalActions].tolist()
+
+    def items(self):
+        return list(zip(self.keys(), self.values()))
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return int(self.legalActions.sum())
+
+    def copy(self):
+        return QTable(self.states, self.actions, self.legalActions, self.array.copy())
+
+    def fill(self, qvalues):
+        """
+        Copies the entries of a (state, action) mapping into the table, skipping the pairs that are not in it
+        """
+        for key, value in qvalues.items():
+            index = self.index(*key)
+            if index is not None:
+                self.array[index] = value
+        self._greedyActions = None
@@ -29,8 +29,12 @@ AUTHORS: Baris Akgun
 
 """
 
-import random, util
-import baseAgents, policies
+import random, util, time, queue
+from collections import deque
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import baseAgents, policies, gridworld
 
 class TemporalDifferencePredictionAgent(baseAgents.BaseModelFreePredictionAgent):
     """
@@ -69,6 +73,136 @@ class TemporalDifferencePredictionAgent(baseAgents.BaseModelFreePredictionAgent)
         self.numSteps += 1
         return True
 
+class EligibilityTraces():
+    """
+    Sparse eligibility traces. Only the nonzero traces are stored (the active set), 
+    decaying touches only them and the traces that fall below the threshold are dropped.
+    """
+    def __init__(self, threshold = 1e-4):
+        self.threshold = threshold
+        self.traces = {}
+
+    def clear(self):
+        self.traces = {}
+
+    def accumulate(self, key, amount = 1.0):
+        """
+        e(key) <- e(key) + amount
+        """
+        self.traces[key] = self.traces.get(key, 0.0) + amount
+
+    def replace(self, key, value = 1.0):
+        """
+        e(key) <- value
+        """
+        self.traces[key] = value
+
+    def decay(self, factor):
+        """
+        e <- factor*e for the active traces, the ones below the threshold are dropped
+        """
+        threshold = self.threshold
+        self.traces = {key: trace*factor for key, trace in self.traces.items() if abs(trace*factor) >= threshold}
+
+    def items(self):
+        return self.traces.items()
+
+    def __getitem__(self, key):
+        return self.traces.get(key, 0.0)
+
+    def __len__(self):
+        return len(self.traces)
+
+class NStepTDPredictionAgent(TemporalDifferencePredictionAgent):
+    """
+    Agent that runs the n-step TD algorithm
+    """
+    def __init__(self, env, discount = 0.9, policy=None, alpha=0.05, alphaScheduler = None, n = 4):
+        """
+        n: The number of rewards in the target before bootstrapping, n = 1 is TD(0)
+        See TemporalDifferencePredictionAgent for the rest
+        """
+        super().__init__(env, discount, policy, alpha=alpha, alphaScheduler=alphaScheduler)
+        self.n = n
+        self.pending = deque()
+
+    def newEpisode(self):
+        super().newEpisode()
+        self.pending.clear()
+
+    def run(self):
+        """
+        Single step of the n-step TD Algorithm. 
+        V(S(t)) is updated when R(t+n) is observed, the remaining states are updated at the end of the episode.
+        Returns False if it encounters a terminal state
+        """
+        currentState = self.env.getCurrentState()
+        if self.isTerminal(currentState):
+            return False
+        action = self.policy(currentState)
+        nextState, reward = self.takeAction(action)
+        self.pending.append((currentState, reward))
+        self.numSteps += 1
+        if self.isTerminal(nextState):
+            while self.pending:
+                self._updateOldest(0.0)
+        elif len(self.pending) == self.n:
+            self._updateOldest(self.values[nextState])
+        return True
+
+    def _updateOldest(self, bootstrapValue):
+        """
+        Updates the oldest pending state towards its discounted pending rewards plus the discounted bootstrapValue
+        """
+        target = bootstrapValue
+        for _, reward in reversed(self.pending):
+            target = reward + self.discount*target
+        state, _ = self.pending.popleft()
+        self.values[state] += self.alpha*(target - self.values[state])
+
+class TDLambdaPredictionAgent(TemporalDifferencePredictionAgent):
+    """
+    Agent that runs the (backward view) TD(lambda) algorithm with sparse eligibility traces
+    """
+    def __init__(self, env, discount = 0.9, policy=None, alpha=0.05, alphaScheduler = None, lambd = 0.9, 
+                 replacingTraces = False, traceThreshold = 1e-4):
+        """
+        lambd: The trace decay parameter, 0 is TD(0) and 1 is every-visit MC in the limit
+        replacingTraces: Reset the trace of a visited state to 1 instead of adding 1 to it
+        traceThreshold: Traces smaller than this are dropped
+        See TemporalDifferencePredictionAgent for the rest
+        """
+        super().__init__(env, discount, policy, alpha=alpha, alphaScheduler=alphaScheduler)
+        self.lambd = lambd
+        self.replacingTraces = replacingTraces
+        self.traces = EligibilityTraces(traceThreshold)
+
+    def newEpisode(self):
+        super().newEpisode()
+        self.traces.clear()
+
+    def run(self):
+        """
+        Single step of the TD(lambda) Algorithm
+        Returns False if it encounters a terminal state
+        """
+        currentState = self.env.getCurrentState()
+        if self.isTerminal(currentState):
+            return False
+        action = self.policy(currentState)
+        nextState, reward = self.takeAction(action)
+        delta = reward + self.discount*self.values[nextState] - self.values[currentState]
+        if self.replacingTraces:
+            self.traces.replace(currentState)
+        else:
+            self.traces.accumulate(currentState)
+        step = self.alpha*delta
+        for state, trace in self.traces.items():
+            self.values[state] += step*trace
+        self.traces.decay(self.discount*self.lambd)
+        self.numSteps += 1
+        return True
+
 class SarsaAgent(baseAgents.BaseModelFreeControlAgent):
     def __init__(self, env, discount = 0.9, epsilon=0.3, alpha=0.05, alphaScheduler = None, epsilonScheduler = None):
 
@@ -121,8 +255,143 @@ class SarsaAgent(baseAgents.BaseModelFreeControlAgent):
         return True
 
         
+class SumTree():
+    """
+    Binary tree over an array of non-negative values, stored in a single array as a heap: 
+    node i has the children 2i and 2i+1 and holds their sum, the values are the leaves. 
+    Setting values and finding the value at a prefix sum take O(log n) each, vectorized over batches.
+    """
+    def __init__(self, capacity):
+        self.numLeaves = 1 << max(0, int(capacity - 1).bit_length())
+        self.depth = self.numLeaves.bit_length() - 1
+        self.nodes = np.zeros(2*self.numLeaves)
+
+    def total(self):
+        return self.nodes[1]
+
+    def get(self, indices):
+        return self.nodes[self.numLeaves + np.asarray(indices)]
+
+    def set(self, indices, values):
+        """
+        Sets the values at the given indices and recomputes the sums above them
+        """
+        nodes = np.unique(self.numLeaves + np.asarray(indices))
+        self.nodes[self.numLeaves + np.asarray(indices)] = values
+        for _ in range(self.depth):
+            nodes = np.unique(nodes//2)
+            self.nodes[nodes] = self.nodes[2*nodes] + self.nodes[2*nodes + 1]
+
+    def setValue(self, index, value):
+        """
+        Sets a single value, cheaper than set for one index
+        """
+        node = self.numLeaves + index
+        nodes = self.nodes
+        nodes[node] = value
+        while node > 1:
+            node //= 2
+            nodes[node] = nodes[2*node] + nodes[2*node + 1]
+
+    def find(self, prefixSums):
+        """
+        Returns the index i of every prefix sum with sum(values[:i]) <= prefixSum < sum(values[:i+1])
+        """
+        prefixSums = np.array(prefixSums, dtype=float)
+        nodes = np.ones(len(prefixSums), dtype=np.int64)
+        for _ in range(self.depth):
+            nodes *= 2
+            leftSums = self.nodes[nodes]
+            right = prefixSums >= leftSums
+            prefixSums -= np.where(right, leftSums, 0.0)
+            nodes += right
+        return nodes - self.numLeaves
+
+class ReplayBuffer():
+    """
+    Ring buffer of (state, action, reward, nextState, done) transitions in preallocated arrays,
+    with states and actions as indices of the compiled gridworld. 
+    Once full, each new transition overwrites the oldest one.
+    Sampling is uniform, or proportional to priority**alpha with importance weights if prioritized.
+    The prioritized buffer keeps priority**alpha in a SumTree, so sampling and updating the priorities 
+    take O(log capacity) per transition.
+    """
+    def __init__(self, capacity, prioritized = False, alpha = 0.6, beta = 0.4, seed = None):
+        """
+        capacity: The maximum number of transitions
+        prioritized: Sample the transitions by their priorities (e.g. TD errors) instead of uniformly
+        alpha: How much the priorities count, 0 is uniform
+        beta: Strength of the importance weight correction of prioritized sampling, 1 corrects fully
+        seed: Seed of the random generator
+        """
+        self.capacity = capacity
+        self.states = np.zeros(capacity, dtype=np.int64)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity)
+        self.nextStates = np.zeros(capacity, dtype=np.int64)
+        self.dones = np.zeros(capacity, dtype=bool)
+        self.priorities = np.zeros(capacity)
+        self.sumTree = SumTree(capacity) if prioritized else None
+        self.prioritized = prioritized
+        self.alpha = alpha
+        self.beta = beta
+        self.rng = np.random.default_rng(seed)
+        self.position = 0
+        self.size = 0
+        self.maxPriority = 1.0
+
+    def add(self, state, action, reward, nextState, done):
+        i = self.position
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.nextStates[i] = nextState
+        self.dones[i] = done
+        # New transitions are sampled at least once with high probability
+        self.priorities[i] = self.maxPriority
+        if self.prioritized:
+            self.sumTree.setValue(i, self.maxPriority**self.alpha)
+        self.position = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def sample(self, batchSize):
+        """
+        Returns the indices, states, actions, rewards, next states, done flags and importance weights 
+        of batchSize transitions sampled with replacement. The weights are all 1 for uniform sampling.
+        """
+        if self.prioritized:
+            total = self.sumTree.total()
+            # Rounding can move a prefix sum past the last transition
+            indices = np.minimum(self.sumTree.find(self.rng.random(batchSize)*total), self.size - 1)
+            probs = self.sumTree.get(indices)/total
+            weights = (self.size*probs)**(-self.beta)
+            weights /= weights.max()
+        else:
+            indices = self.rng.integers(0, self.size, batchSize)
+            weights = np.ones(batchSize)
+        return (indices, self.states[indices], self.actions[indices], self.rewards[indices], 
+                self.nextStates[indices], self.dones[indices], weights)
+
+    def updatePriorities(self, indices, priorities, epsilon = 1e-6):
+        """
+        Sets the priorities of the sampled transitions, usually to their absolute TD errors
+        """
+        priorities = np.abs(priorities) + epsilon
+        self.priorities[indices] = priorities
+        self.sumTree.set(indices, priorities**self.alpha)
+        self.maxPriority = max(self.maxPriority, priorities.max())
+
+    def __len__(self):
+        return self.size
+
 class QLearningAgent(baseAgents.BaseModelFreeControlAgent):
-    def __init__(self, env, discount = 0.9, epsilon=0.3, alpha=0.05, alphaScheduler = None, epsilonScheduler = None):
+    def __init__(self, env, discount = 0.9, epsilon=0.3, alpha=0.05, alphaScheduler = None, epsilonScheduler = None,
+                 replayBuffer = None, batchSize = 32):
+        """
+        replayBuffer: If given, every step is stored in this ReplayBuffer and the q-values are updated with 
+            a minibatch sampled from it instead of the step itself. The q-values become a tables.QTable
+        batchSize: The size of the minibatches
+        """
         super().__init__(env, discount, alpha, alphaScheduler, epsilon, epsilonScheduler)
 
         """
@@ -132,6 +401,12 @@ class QLearningAgent(baseAgents.BaseModelFreeControlAgent):
         #You need to pick the correct policy! Set the below field to the correct one
         self.policy = policies.PolicyFromQValues(self)
         
+        self.replayBuffer = replayBuffer
+        self.batchSize = batchSize
+        if replayBuffer is not None:
+            self.model = env.gridWorld.compile()
+            self.useQTable(self.model)
+        
     """
     You can add your own functions
     """
@@ -154,6 +429,9 @@ class QLearningAgent(baseAgents.BaseModelFreeControlAgent):
         return False when the episode ends, return True otherwise!
         """
 
+        if self.replayBuffer is not None:
+            return self._runWithReplay()
+
         currentState = self.env.getCurrentState()
         currentAction = self.policy(currentState)
         nextState, reward = self.takeAction(currentAction)
@@ -169,4 +447,425 @@ class QLearningAgent(baseAgents.BaseModelFreeControlAgent):
         self.qvalues[(currentState, currentAction)] += self.alpha*(reward + self.discount*self.qvalues[(nextState, nextAction)]) - (1-self.alpha)*self.qvalues[(currentState, currentAction)]
         self.numSteps += 1
         return True
-       
\ No newline at end of file
+
+    def _runWithReplay(self):
+        """
+        Single step of Q-Learning with experience replay: the step is stored and a minibatch is replayed
+        """
+        currentState = self.env.getCurrentState()
+        if self.isTerminal(currentState):
+            return False
+        currentAction = self.getEpsilonGreedyAction(currentState)
+        nextState, reward = self.takeAction(currentAction)
+        model = self.model
+        self.replayBuffer.add(model.stateIndex[currentState], model.actionIndex[currentAction], reward, 
+                              model.stateIndex[nextState], self.isTerminal(nextState))
+        self.replay()
+        self.numSteps += 1
+        return True
+
+    def replay(self, batchSize = None):
+        """
+        Samples a minibatch from the replay buffer and applies its Q-learning updates to the q-value array at once.
+        Returns the TD errors of the minibatch
+        """
+        indices, states, actions, rewards, nextStates, dones, weights = self.replayBuffer.sample(batchSize or self.batchSize)
+        errors = self.updateBatch(states, actions, rewards, nextStates, dones, weights)
+        if self.replayBuffer.prioritized:
+            self.replayBuffer.updatePriorities(indices, errors)
+        return errors
+
+    def updateBatch(self, states, actions, rewards, nextStates, dones, weights = None):
+        """
+        Q(s,a) <- Q(s,a) + alpha*w*(r + discount*max_a' Q(s',a') - Q(s,a)) for a batch of transitions given as
+        index arrays. All TD errors use the q-values before the batch, the updates of repeated pairs add up.
+        Returns the TD errors
+        """
+        Q = self.qvalues.array
+        legal = self.model.legalActions
+        nextValues = np.where(legal[nextStates], Q[nextStates], -np.inf).max(axis=1)
+        targets = rewards + self.discount*np.where(dones, 0.0, nextValues)
+        errors = targets - Q[states, actions]
+        steps = self.alpha*errors if weights is None else self.alpha*weights*errors
+        np.add.at(Q, (states, actions), steps)
+        self.qvalues.refreshGreedy(states)
+        return errors
+       
+
+class DenseTDControlAgent(baseAgents.BaseModelFreeControlAgent):
+    """
+    Base class of the one-step TD control agents that work on the rows of a tables.QTable directly.
+    The actions are selected epsilon-greedily from the row of the current state and the next state
+    is valued from its row by getNextValue, without going through the policy or building dictionaries.
+    Subclasses define getNextValue and may override backup.
+    """
+    def __init__(self, env, discount = 0.9, epsilon=0.3, alpha=0.05, alphaScheduler = None, epsilonScheduler = None):
+        """
+        env: Environment of the agent, a GridworldEnvironment
+        See baseAgents.BaseModelFreeControlAgent for the rest
+        """
+        super().__init__(env, discount, alpha, alphaScheduler, epsilon, epsilonScheduler)
+        self.policy = policies.PolicyFromQValues(self)
+        self.model = env.gridWorld.compile()
+        self.useQTable(self.model)
+        self.legalActionLists = [np.flatnonzero(row).tolist() for row in self.model.legalActions]
+
+    def newEpisode(self):
+        super().newEpisode()
+        self.numSteps = 0
+
+    def run(self):
+        """
+        Single step of the TD control algorithm
+        Returns False if it encounters a terminal state
+        """
+        currentState = self.env.getCurrentState()
+        if self.isTerminal(currentState):
+            return False
+        model = self.model
+        s = model.stateIndex[currentState]
+        a = self.selectAction(s)
+        nextState, reward = self.takeAction(model.actions[a])
+        self.backup(s, a, reward, model.stateIndex[nextState])
+        self.numSteps += 1
+        return True
+
+    def selectAction(self, s):
+        """
+        Returns the epsilon-greedy action index of the state index s from its row
+        """
+        legal = self.legalActionLists[s]
+        if random.random() < self.epsilon:
+            return random.choice(legal)
+        return self.qvalues.getGreedyIndex(s)
+
+    def backup(self, s, a, reward, nextS):
+        """
+        Q(s,a) <- Q(s,a) + alpha*(reward + discount*getNextValue(nextS) - Q(s,a))
+        """
+        Q = self.qvalues.array
+        target = reward + self.discount*self.getNextValue(nextS)
+        self.qvalues.setValue(s, a, Q[s, a] + self.alpha*(target - Q[s, a]))
+
+    def getNextValue(self, s):
+        """
+        Returns the value of the next state index s used in the TD target
+        """
+        pass
+
+def rowArgMax(row, legal):
+    """
+    Returns the first legal action index with the largest value in the row (a list)
+    """
+    best = legal[0]
+    bestValue = row[best]
+    for a in legal:
+        if row[a] > bestValue:
+            best, bestValue = a, row[a]
+    return best
+
+def rowMax(row, legal):
+    """
+    Returns the largest value of the legal actions in the row (a list), 0 if there are none
+    """
+    if not legal:
+        return 0.0
+    return max(row[a] for a in legal)
+
+def rowExpectation(row, legal, epsilon):
+    """
+    Returns the expected value of the row (a list) under the epsilon-greedy policy over the legal actions, 
+    0 if there are none
+    """
+    if not legal:
+        return 0.0
+    values = [row[a] for a in legal]
+    return epsilon*sum(values)/len(values) + (1 - epsilon)*max(values)
+
+class ExpectedSarsaAgent(DenseTDControlAgent):
+    """
+    Expected Sarsa, the next state is valued by the expectation of its q-values under the epsilon-greedy policy
+    """
+    def getNextValue(self, s):
+        return rowExpectation(self.qvalues.array[s].tolist(), self.legalActionLists[s], self.epsilon)
+
+class DoubleQLearningAgent(DenseTDControlAgent):
+    """
+    Double Q-learning with two q-value arrays. Each step updates one of them at random, 
+    with the greedy next action of that array valued by the other one. 
+    self.qvalues holds their average, which the actions are selected from.
+    """
+    def __init__(self, env, discount = 0.9, epsilon=0.3, alpha=0.05, alphaScheduler = None, epsilonScheduler = None):
+        super().__init__(env, discount, epsilon, alpha, alphaScheduler, epsilonScheduler)
+        self.qvaluesA = self.qvalues.array.copy()
+        self.qvaluesB = self.qvalues.array.copy()
+
+    def backup(self, s, a, reward, nextS):
+        if random.random() < 0.5:
+            updated, other = self.qvaluesA, self.qvaluesB
+        else:
+            updated, other = self.qvaluesB, self.qvaluesA
+        legal = self.legalActionLists[nextS]
+        target = reward
+        if legal:
+            target += self.discount*other[nextS, rowArgMax(updated[nextS].tolist(), legal)]
+        updated[s, a] += self.alpha*(target - updated[s, a])
+        self.qvalues.setValue(s, a, (self.qvaluesA[s, a] + self.qvaluesB[s, a])/2)
+
+class DynaQAgent(baseAgents.BaseModelFreeControlAgent):
+    """
+    Agent that runs Dyna-Q: Q-learning from the real steps plus planning updates from a learned model.
+    The model counts the observed next states of every (state, action) and sums its rewards, in arrays indexed 
+    by the compiled gridworld, and the planning updates are expected backups over these empirical distributions.
+    The real steps are sampled Q-learning updates, or only queued in the prioritized mode.
+    The q-values are a tables.QTable over the same indices.
+    """
+    def __init__(self, env, discount = 0.9, epsilon=0.3, alpha=0.05, alphaScheduler = None, epsilonScheduler = None, 
+                 planningSteps = 10, prioritized = False, priorityThreshold = 1e-4):
+        """
+        env: Environment of the agent, a GridworldEnvironment
+        planningSteps: The number of planning updates after each real step
+        prioritized: Pick the planning updates from a util.PriorityQueue ordered by the size of their 
+            TD errors (prioritized sweeping) instead of uniformly from the observed (state, action) pairs
+        priorityThreshold: Pairs with TD errors below this are not queued
+        See baseAgents.BaseModelFreeControlAgent for the rest
+        """
+        super().__init__(env, discount, alpha, alphaScheduler, epsilon, epsilonScheduler)
+        self.policy = policies.PolicyFromQValues(self)
+        self.planningSteps = planningSteps
+        self.prioritized = prioritized
+        self.priorityThreshold = priorityThreshold
+
+        model = env.gridWorld.compile()
+        self.model = model
+        self.useQTable(model)
+
+        # key = state*numActions + action. A (state, action) has at most width next states, 
+        # modelCounts[key, k] counts the visits of the k-th one of the padded transitions
+        nextStates, _, _ = model.getPaddedTransitions()
+        numKeys, width = model.numStates*model.numActions, nextStates.shape[2]
+        self.successorStates = nextStates.reshape(numKeys, width).tolist()
+        self.modelCounts = np.zeros((numKeys, width), dtype=np.int64)
+        self.modelTotals = np.zeros(numKeys, dtype=np.int64)
+        self.modelRewardSums = np.zeros(numKeys)
+        self.observedKeys = []
+        self.predecessors = {}
+        self.queue = util.PriorityQueue()
+        # The largest priority each key is queued with, the queue has no decrease-key so other entries are outdated
+        self.queuedPriorities = {}
+
+    def newEpisode(self):
+        super().newEpisode()
+        self.numSteps = 0
+
+    def run(self):
+        """
+        Single real step of the Dyna-Q Algorithm followed by the planning updates
+        Returns False if it encounters a terminal state
+        """
+        currentState = self.env.getCurrentState()
+        if self.isTerminal(currentState):
+            return False
+        action = self.getEpsilonGreedyAction(currentState)
+        nextState, reward = self.takeAction(action)
+        model = self.model
+        s, a = model.stateIndex[currentState], model.actionIndex[action]
+        key = s*model.numActions + a
+        self._observe(key, reward, model.stateIndex[nextState])
+        if self.prioritized:
+            self._pushIfLarge(key)
+            self._planPrioritized()
+        else:
+            target = reward + self.discount*self.qvalues.getMaxValue(model.stateIndex[nextState])
+            self.qvalues.setValue(s, a, self.qvalues.array[s, a] + self.alpha*(target - self.qvalues.array[s, a]))
+            self._planUniform()
+        self.numSteps += 1
+        return True
+
+    def _observe(self, key, reward, nextState):
+        """
+        Adds the outcome of (state, action) = divmod(key, numActions) to the counts of the model
+        """
+        if self.modelTotals[key] == 0:
+            self.observedKeys.append(key)
+        # The real next states come first in the padded row, so the first match is the right slot
+        self.modelCounts[key, self.successorStates[key].index(nextState)] += 1
+        self.modelTotals[key] += 1
+        self.modelRewardSums[key] += reward
+        self.predecessors.setdefault(nextState, set()).add(key)
+
+    def _getTDError(self, key):
+        """
+        Returns E[r + discount*max_a' Q(s',a')] - Q(s,a) over the observed outcomes of the key
+        """
+        getMaxValue = self.qvalues.getMaxValue
+        nextValues = sum(count*getMaxValue(nextState) 
+                         for nextState, count in zip(self.successorStates[key], self.modelCounts[key].tolist()) if count)
+        target = (self.modelRewardSums[key] + self.discount*nextValues)/self.modelTotals[key]
+        s, a = divmod(key, self.model.numActions)
+        return target - self.qvalues.array[s, a]
+
+    def _backup(self, key):
+        """
+        Expected Q-learning update of the key from the model
+        """
+        s, a = divmod(key, self.model.numActions)
+        self.qvalues.setValue(s, a, self.qvalues.array[s, a] + self.alpha*self._getTDError(key))
+
+    def _pushIfLarge(self, key):
+        """
+        Queues the key if its TD error is above the threshold and above the priority it is already queued with
+        """
+        priority = abs(self._getTDError(key))
+        if priority > self.priorityThreshold and priority > self.queuedPriorities.get(key, 0.0):
+            self.queuedPriorities[key] = priority
+            self.queue.push((key, priority), -priority)
+            if len(self.queue.heap) > 2*len(self.modelTotals):
+                # Drop the outdated entries, so the queue never holds more than twice the number of keys
+                self.queue = util.PriorityQueue()
+                for queuedKey, queuedPriority in self.queuedPriorities.items():
+                    self.queue.push((queuedKey, queuedPriority), -queuedPriority)
+
+    def _planUniform(self):
+        observedKeys = self.observedKeys
+        for _ in range(self.planningSteps):
+            self._backup(random.choice(observedKeys))
+
+    def _planPrioritized(self):
+        numActions = self.model.numActions
+        numBackups = 0
+        while numBackups < self.planningSteps and not self.queue.isEmpty():
+            key, priority = self.queue.pop()
+            # Skip the outdated entries, of keys queued again with a larger priority or already backed up
+            if self.queuedPriorities.get(key) != priority:
+                continue
+            del self.queuedPriorities[key]
+            self._backup(key)
+            numBackups += 1
+            for predecessor in self.predecessors.get(key//numActions, ()):
+                self._pushIfLarge(predecessor)
+
+def _hogwildWorker(workerId, gridWorld, sharedName, discount, alpha, epsilon, numEpisodes, seed, locks, metricsQueue, reportEvery):
+    """
+    Worker of HogwildQLearningAgent, runs in its own process.
+    Runs numEpisodes Q-learning episodes on its own GridworldEnvironment and updates the q-value array in the 
+    shared memory block sharedName in place. If locks is not empty, the row of state s is updated while 
+    holding locks[s % len(locks)], otherwise without any locking.
+    Every reportEvery episodes (and at the end) it puts its counts since the last report on metricsQueue.
+    """
+    random.seed(seed)
+    model = gridWorld.compile()
+    env = gridworld.GridworldEnvironment(gridWorld)
+    shared = shared_memory.SharedMemory(name=sharedName)
+    Q = np.ndarray((model.numStates, model.numActions), dtype=np.float64, buffer=shared.buf)
+    legalActionLists = [np.flatnonzero(row).tolist() for row in model.legalActions]
+    terminal = model.terminalIndex
+    try:
+        steps, returns, absErrors, reported = 0, 0.0, 0.0, 0
+        for episode in range(1, numEpisodes + 1):
+            env.reset()
+            s = model.stateIndex[env.getCurrentState()]
+            while s != terminal:
+                legal = legalActionLists[s]
+                if random.random() < epsilon:
+                    a = random.choice(legal)
+                else:
+                    a = rowArgMax(Q[s].tolist(), legal)
+                nextState, reward = env.doAction(model.actions[a])
+                nextS = model.stateIndex[nextState]
+                target = reward + discount*rowMax(Q[nextS].tolist(), legalActionLists[nextS])
+                if locks:
+                    with locks[s % len(locks)]:
+                        error = target - Q[s, a]
+                        Q[s, a] += alpha*error
+                else:
+                    error = target - Q[s, a]
+                    Q[s, a] += alpha*error
+                steps += 1
+                returns += reward
+                absErrors += abs(error)
+                s = nextS
+            if episode % reportEvery == 0 or episode == numEpisodes:
+                metricsQueue.put((workerId, episode - reported, steps, returns, absErrors, time.time()))
+                steps, returns, absErrors, reported = 0, 0.0, 0.0, episode
+    finally:
+        del Q
+        shared.close()
+
+class HogwildQLearningAgent(baseAgents.BaseModelFreeControlAgent):
+    """
+    Q-learning with several worker processes that update one q-value array in shared memory,
+    without locks (Hogwild) or with striped locks over the states.
+    runParallel is the coordinator: it starts the workers, collects their metrics and copies the 
+    learned q-values back into self.qvalues, a tables.QTable.
+    """
+    def __init__(self, env, discount = 0.9, epsilon=0.3, alpha=0.05, numWorkers = None, lockStripes = 0):
+        """
+        env: Environment of the agent, a GridworldEnvironment. Each worker runs its own copy
+        numWorkers: The number of worker processes, os.cpu_count() if None
+        lockStripes: The number of locks the states are striped over, 0 updates without locks
+        See baseAgents.BaseModelFreeControlAgent for the rest
+        """
+        super().__init__(env, discount, alpha = alpha, epsilon = epsilon)
+        self.policy = policies.PolicyFromQValues(self)
+        self.numWorkers = numWorkers
+        self.lockStripes = lockStripes
+        self.model = env.gridWorld.compile()
+        self.useQTable(self.model)
+        self.metrics = []
+
+    def runParallel(self, numEpisodes, seed = None, reportEvery = 100):
+        """
+        Runs numEpisodes episodes split over the workers, each with its own random stream spawned from seed.
+        Every worker report adds an entry to self.metrics with the elapsed time, the total episodes and steps, 
+        the steps per second, the mean return and absolute TD error of the reported episodes and the largest 
+        change of the q-values since the previous report.
+        Returns self.qvalues
+        """
+        model = self.model
+        counts, seedSequences = baseAgents.splitEpisodes(numEpisodes, self.numWorkers, seed)
+        numWorkers = len(counts)
+        seeds = [int(seedSequence.generate_state(1)[0]) for seedSequence in seedSequences]
+        
+        shared = shared_memory.SharedMemory(create=True, size=self.qvalues.array.nbytes)
+        try:
+            Q = np.ndarray(self.qvalues.array.shape, dtype=np.float64, buffer=shared.buf)
+            Q[:] = self.qvalues.array
+            locks = [multiprocessing.Lock() for _ in range(self.lockStripes)]
+            metricsQueue = multiprocessing.Queue()
+            workers = [multiprocessing.Process(target=_hogwildWorker, 
+                                               args=(i, self.env.gridWorld, shared.name, self.discount, self.alpha, self.epsilon, 
+                                                     counts[i], seeds[i], locks, metricsQueue, reportEvery))
+                       for i in range(numWorkers)]
+            startTime = time.time()
+            for worker in workers:
+                worker.start()
+            
+            totalEpisodes, totalSteps = 0, 0
+            lastQ = Q.copy()
+            while totalEpisodes < numEpisodes:
+                if not any(worker.is_alive() for worker in workers) and metricsQueue.empty():
+                    raise Exception('Hogwild workers stopped after %d of %d episodes' % (totalEpisodes, numEpisodes))
+                try:
+                    workerId, episodes, steps, returns, absErrors, reportTime = metricsQueue.get(timeout=1.0)
+                except queue.Empty:
+                    continue
+                totalEpisodes += episodes
+                totalSteps += steps
+                elapsed = reportTime - startTime
+                snapshot = Q.copy()
+                self.metrics.append({'worker': workerId, 'time': elapsed, 'episodes': totalEpisodes, 'steps': totalSteps,
+                                     'stepsPerSecond': totalSteps/elapsed if elapsed > 0 else 0.0,
+                                     'meanReturn': returns/episodes, 'meanAbsTDError': float(absErrors)/max(steps, 1),
+                                     'maxQChange': float(np.abs(snapshot - lastQ).max())})
+                lastQ = snapshot
+            for worker in workers:
+                worker.join()
+            self.qvalues.array[:] = Q
+            self.qvalues.refreshGreedy()
+            del Q
+        finally:
+            shared.close()
+            shared.unlink()
+        self.numEpisodes += numEpisodes
+        return self.qvalues
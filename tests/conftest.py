@@ -0,0 +1,8 @@
+"""
+The modules of the repository are top level modules, make them importable from the tests
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,88 @@
+"""
+Checks that the policy evaluation methods agree with an exact sparse solve
+"""
+
+import warnings
+
+import numpy as np
+import pytest
+import scipy.sparse
+import scipy.sparse.linalg
+
+import gridworld
+import dpAgents
+
+GRIDS = ['BookGrid', 'BridgeGrid', 'CliffGrid', 'MazeGrid', 'DiscountGrid']
+
+def makeAgent(mdp, **kwargs):
+    env = gridworld.GridworldEnvironment(mdp)
+    agent = dpAgents.PolicyEvaluationAgent(mdp, env, 0.9, **kwargs)
+    agent.getPossibleActions = mdp.getPossibleActions
+    agent.isTerminal = mdp.isTerminal
+    return agent
+
+def exactValues(agent, model):
+    rPi, states, nextStates, probs = agent._policyTransitions(model)
+    PPi = scipy.sparse.csr_matrix((probs, (states, nextStates)), shape=(model.numStates, model.numStates))
+    A = (scipy.sparse.identity(model.numStates, format='csr') - agent.discount*PPi).tocsc()
+    return scipy.sparse.linalg.splu(A).solve(rPi)
+
+@pytest.mark.parametrize('method,solver', [('iterative', 'lu'), ('jacobi', 'lu'), ('gauss-seidel', 'lu'),
+                                           ('solve', 'lu'), ('solve', 'gmres')])
+@pytest.mark.parametrize('name', GRIDS)
+def test_policyEvaluation(name, method, solver):
+    mdp = getattr(gridworld, 'get' + name)()
+    agent = makeAgent(mdp, method = method, solver = solver)
+    with warnings.catch_warnings():
+        # The iterative solver must converge by itself, not through its fallback
+        warnings.simplefilter('error')
+        agent.run()
+    model = mdp.compile()
+    values = np.array([agent.getValue(state) for state in model.states])
+    assert np.abs(values - exactValues(agent, model)).max() < agent.errorThreshold
+
+@pytest.mark.parametrize('name', GRIDS)
+def test_jacobiIterations(name):
+    iterations = [makeAgent(getattr(gridworld, 'get' + name)(), method = method).run() for method in ('iterative', 'jacobi')]
+    assert iterations[0] == iterations[1]
+
+def makeDpAgent(agentClass, mdp):
+    env = gridworld.GridworldEnvironment(mdp)
+    agent = agentClass(mdp, env, 0.9)
+    agent.getPossibleActions = mdp.getPossibleActions
+    agent.isTerminal = mdp.isTerminal
+    return agent
+
+@pytest.mark.parametrize('agentClass', [dpAgents.QValueIterationAgent, dpAgents.VectorizedQValueIterationAgent,
+                                        dpAgents.PolicyIterationAgent])
+def test_resolve(agentClass):
+    coldMdp = gridworld.getBookGrid()
+    coldMdp.setNoise(0.3)
+    cold = makeDpAgent(agentClass, coldMdp)
+    coldIterations = cold.run()
+
+    warm = makeDpAgent(agentClass, gridworld.getBookGrid())
+    warm.run()
+    warmIterations = warm.resolve({'noise': 0.3})
+    assert warmIterations < coldIterations
+    for state in coldMdp.getStates():
+        assert warm.getValue(state) == pytest.approx(cold.getValue(state), abs=0.01)
+
+def test_warmStart():
+    mdp = gridworld.getBookGrid()
+    cold = makeDpAgent(dpAgents.QValueIterationAgent, mdp)
+    coldIterations = cold.run()
+    warm = makeDpAgent(dpAgents.QValueIterationAgent, mdp)
+    warm.warmStart(qvalues = cold.getQValues())
+    assert warm.run() < coldIterations
+
+def test_resolveRejectsDiscount():
+    agent = makeDpAgent(dpAgents.QValueIterationAgent, gridworld.getBookGrid())
+    with pytest.raises(Exception):
+        agent.resolve({'discount': 0.5})
+    assert agent.mdp.discount == 1
+
+def test_policyIterationRejectsNoEvaluation():
+    mdp = gridworld.getBookGrid()
+    with pytest.raises(Exception):
+        dpAgents.PolicyIterationAgent(mdp, gridworld.GridworldEnvironment(mdp), evaluationIters = 0)
@@ -0,0 +1,92 @@
+"""
+Checks of the compiled transition model against the dictionary based Gridworld
+"""
+
+import numpy as np
+import pytest
+
+import gridworld
+
+GRIDS = ['BookGrid', 'BridgeGrid', 'CliffGrid', 'CliffGrid2', 'MazeGrid', 'DiscountGrid', 'SimpleGrid']
+
+def getGrid(name, noise, livingReward = -0.3):
+    mdp = getattr(gridworld, 'get' + name)()
+    mdp.setNoise(noise)
+    mdp.setLivingReward(livingReward)
+    return mdp
+
+@pytest.mark.parametrize('noise', [0.0, 0.2, 1.0])
+@pytest.mark.parametrize('name', GRIDS)
+def test_compiledTransitions(name, noise):
+    mdp = getGrid(name, noise)
+    model = mdp.compile()
+    assert model.states == mdp.getStates()
+    for state in mdp.getStates():
+        for action in model.actions:
+            row = model.rowIndex(state, action)
+            if action not in mdp.getPossibleActions(state):
+                assert row is None
+                continue
+            assert mdp.getTransitionStatesAndProbs(state, action) == mdp._computeTransitionStatesAndProbs(state, action)
+            successors = [model.states[j] for j in model.indices[model.indptr[row]:model.indptr[row+1]]]
+            probs = model.probs[model.indptr[row]:model.indptr[row+1]].tolist()
+            assert list(zip(successors, probs)) == mdp._computeTransitionStatesAndProbs(state, action)
+            rewards = model.rewards[model.indptr[row]:model.indptr[row+1]].tolist()
+            assert rewards == [mdp.getReward(state, action, nextState) for nextState in successors]
+
+@pytest.mark.parametrize('name', GRIDS)
+def test_cumulativeProbs(name):
+    model = getGrid(name, 0.2).compile()
+    _, probs, _ = model.getPaddedTransitions()
+    cumProbs = model.getCumulativeProbs()
+    counts = np.diff(model.indptr).reshape(model.numStates, model.numActions)
+    for s, a in zip(*np.nonzero(model.legalActions)):
+        n = counts[s, a]
+        assert np.allclose(cumProbs[s, a, :n-1], np.cumsum(probs[s, a, :n-1]))
+        assert np.all(np.isinf(cumProbs[s, a, n-1:]))
+
+def test_sampleTransitions():
+    model = getGrid('BookGrid', 0.2).compile()
+    nextStates, probs, rewards = model.getPaddedTransitions()
+    s, a = model.stateIndex[(0, 0)], model.actionIndex['north']
+    numSamples = 20000
+    rng = np.random.default_rng(0)
+    sampled, sampledRewards = model.sampleTransitions(np.full(numSamples, s), np.full(numSamples, a), rng)
+    for k in range(np.diff(model.indptr)[s*model.numActions + a]):
+        frequency = np.mean(sampled == nextStates[s, a, k])
+        assert abs(frequency - probs[s, a, k]) < 0.02
+    assert np.all(sampledRewards == rewards[s, a, 0])
+
+def test_compileIsInvalidated():
+    mdp = gridworld.getBookGrid()
+    model = mdp.compile()
+    assert mdp.compile() is model
+    mdp.setNoise(0.1)
+    assert mdp.compile() is not model
+    model = mdp.compile()
+    mdp.setLivingReward(-1)
+    assert mdp.compile() is not model
+
+def test_vecEnvResetsFinishedEpisodes():
+    mdp = getGrid('BookGrid', 0.2)
+    env = gridworld.VecGridworldEnv(mdp, 4, seed = 0)
+    model = env.model
+    exitState, start = model.stateIndex[(3, 2)], model.stateIndex[(0, 0)]
+    env.states[:2] = exitState
+    actions = [model.actionIndex['exit']]*2 + [model.actionIndex['north']]*2
+    nextStates, rewards, dones = env.step(actions)
+    assert dones.tolist() == [True, True, False, False]
+    assert nextStates[:2].tolist() == [model.terminalIndex]*2
+    assert rewards[:2].tolist() == [1.0, 1.0]
+    assert env.numEpisodes == 2
+    states = env.getCurrentStates()
+    assert states[:2].tolist() == [start]*2
+    assert states[2:].tolist() == nextStates[2:].tolist()
+
+def test_vecEnvRejectsIllegalActions():
+    env = gridworld.VecGridworldEnv(gridworld.getBookGrid(), 3, seed = 0)
+    actions = [env.model.actionIndex['north'], env.model.actionIndex['exit'], env.model.actionIndex['north']]
+    with pytest.raises(Exception):
+        env.step(actions)
+    assert env.getCurrentStates().tolist() == [env.startState]*3
+    assert env.numEpisodes == 0
@@ -0,0 +1,108 @@
+"""
+Checks of the vectorized return computations against plain loops and of the MC control schedules
+"""
+
+import random
+
+import numpy as np
+import pytest
+
+import gridworld
+import mcAgents
+
+def getEpisodeEnds(episodeStarts, n):
+    return list(episodeStarts[1:]) + [n]
+
+def referenceReturns(rewards, discount, episodeStarts):
+    returns = np.zeros(len(rewards))
+    for start, end in zip(episodeStarts, getEpisodeEnds(episodeStarts, len(rewards))):
+        G = 0.0
+        for t in range(end - 1, start - 1, -1):
+            G = rewards[t] + discount*G
+            returns[t] = G
+    return returns
+
+def referenceSuffixProducts(values, episodeStarts):
+    products = np.zeros(len(values))
+    for start, end in zip(episodeStarts, getEpisodeEnds(episodeStarts, len(values))):
+        product = 1.0
+        for t in range(end - 1, start - 1, -1):
+            products[t] = product
+            product *= values[t]
+    return products
+
+def randomEpisodes(rng, maxLength):
+    lengths = rng.integers(1, maxLength, rng.integers(1, 6))
+    return np.r_[0, np.cumsum(lengths)[:-1]], int(lengths.sum())
+
+@pytest.mark.parametrize('discount', [0.0, 0.01, 0.5, 0.9, 0.999, 1.0])
+def test_discountedReturns(discount):
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        episodeStarts, n = randomEpisodes(rng, 300)
+        rewards = rng.normal(0, 10, n)
+        returns = mcAgents.discountedReturns(rewards, discount, episodeStarts)
+        assert np.allclose(returns, referenceReturns(rewards, discount, episodeStarts), rtol=1e-9, atol=1e-9)
+    rewards = rng.normal(size=50)
+    assert np.allclose(mcAgents.discountedReturns(rewards, discount), referenceReturns(rewards, discount, [0]))
+
+def test_suffixProducts():
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        episodeStarts, n = randomEpisodes(rng, 50)
+        values = rng.uniform(0, 2, n)
+        values[rng.random(n) < 0.1] = 0.0
+        products = mcAgents._suffixProducts(values, episodeStarts)
+        assert np.allclose(products, referenceSuffixProducts(values, episodeStarts))
+
+def test_accumulateReturns():
+    states = np.array([1, 2, 1, 3, 1, 2])
+    returns = np.arange(6.0)
+    visited, returnSums, visitCounts = mcAgents.accumulateReturns(states, returns)
+    assert visited.tolist() == [1, 2, 3]
+    assert returnSums.tolist() == [6.0, 6.0, 3.0]
+    assert visitCounts.tolist() == [3, 2, 1]
+    visited, returnSums, visitCounts = mcAgents.accumulateReturns(states, returns, True, [0, 3])
+    assert visited.tolist() == [1, 2, 3]
+    assert returnSums.tolist() == [0.0 + 4.0, 1.0 + 5.0, 3.0]
+    assert visitCounts.tolist() == [2, 2, 1]
+
+def makeControlAgent(mdp, batchSize):
+    env = gridworld.GridworldEnvironment(mdp)
+    agent = mcAgents.MonteCarloControlAgent(env, epsilon = 0.3, batchSize = batchSize)
+    agent.getPossibleActions = mdp.getPossibleActions
+    agent.isTerminal = mdp.isTerminal
+    return agent
+
+def test_glieStepsPerUpdate():
+    random.seed(0)
+    mdp = gridworld.getBookGrid()
+    serial = makeControlAgent(mdp, 50)
+    for _ in range(200):
+        serial.env.reset()
+        serial.run()
+    batched = makeControlAgent(mdp, 50)
+    for i in range(4):
+        batched.runBatch(50, 1, seed = i)
+    assert serial.numEpisodes == batched.numEpisodes == 200
+    assert serial.epsilon == batched.epsilon == pytest.approx(0.3/4)
+
+class ListScheduler():
+    def __init__(self, values):
+        self.values = iter(values)
+
+    def update(self):
+        return next(self.values)
+
+def test_schedulerStartsWithFirstBatch():
+    mdp = gridworld.getBookGrid()
+    env = gridworld.GridworldEnvironment(mdp)
+    agent = mcAgents.MonteCarloControlAgent(env, epsilon = 0.3, epsilonScheduler = ListScheduler([0.5, 0.25, 0.125]), batchSize = 2)
+    agent.getPossibleActions = mdp.getPossibleActions
+    agent.isTerminal = mdp.isTerminal
+    epsilons = []
+    for _ in range(6):
+        agent.env.reset()
+        agent.run()
+        epsilons.append(agent.epsilon)
+    assert epsilons == [0.5, 0.5, 0.25, 0.25, 0.125, 0.125]
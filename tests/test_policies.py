@@ -0,0 +1,59 @@
+"""
+Checks of the batched epsilon-greedy sampling of the policies
+"""
+
+from types import SimpleNamespace
+
+import numpy as np
+
+import gridworld
+import policies
+import util
+
+def makeAgent(mdp, **kwargs):
+    return SimpleNamespace(getPossibleActions = mdp.getPossibleActions, isTerminal = mdp.isTerminal, **kwargs)
+
+def test_sampleLegalActions():
+    mdp = gridworld.getMazeGrid()
+    model = mdp.compile()
+    agent = makeAgent(mdp, qvalues = util.Counter())
+    states = np.repeat(np.arange(model.numStates), 50)
+    hasActions = model.legalActions[states].any(axis=1)
+    rng = np.random.default_rng(0)
+    for policy in [policies.RandomPolicy(agent), policies.PolicyFromQValues(agent)]:
+        for epsilon in [0.0, 0.5, 1.0]:
+            actions = policy.sample(states, rng, epsilon, model)
+            assert np.all(actions[~hasActions] == -1)
+            assert np.all(model.legalActions[states[hasActions], actions[hasActions]])
+
+def test_qvalueTiesAreUniform():
+    mdp = gridworld.getBookGrid()
+    model = mdp.compile()
+    agent = makeAgent(mdp, qvalues = util.Counter())
+    start = model.stateIndex[(0, 0)]
+    agent.qvalues[((0, 0), 'north')] = 1.0
+    agent.qvalues[((0, 0), 'east')] = 1.0
+    numSamples = 20000
+    actions = policies.PolicyFromQValues(agent).sample(np.full(numSamples, start), np.random.default_rng(0), 0.0, model)
+    frequencies = np.bincount(actions, minlength=model.numActions)/numSamples
+    assert abs(frequencies[model.actionIndex['north']] - 0.5) < 0.02
+    assert abs(frequencies[model.actionIndex['east']] - 0.5) < 0.02
+    assert frequencies[model.actionIndex['north']] + frequencies[model.actionIndex['east']] == 1.0
+
+def test_tabularIndicesFollowWrites():
+    mdp = gridworld.getBookGrid()
+    model = mdp.compile()
+    agent = makeAgent(mdp, values = {})
+    table = {state: (None if mdp.isTerminal(state) else mdp.getPossibleActions(state)[0]) for state in mdp.getStates()}
+    policy = policies.TabularPolicy(agent, table)
+    states = np.arange(model.numStates)
+    rng = np.random.default_rng(0)
+    before = policy.getGreedyIndices(states, rng, model).copy()
+    policy[(0, 0)] = 'east'
+    after = policy.getGreedyIndices(states, rng, model)
+    start = model.stateIndex[(0, 0)]
+    assert after[start] == model.actionIndex['east']
+    assert np.array_equal(np.delete(after, start), np.delete(before, start))
+    policy.policyTable[(0, 0)] = 'north'
+    policy.refreshIndices()
+    assert policy.getGreedyIndices(states, rng, model)[start] == model.actionIndex['north']
@@ -0,0 +1,56 @@
+"""
+Checks of the greedy cache of QTable against a full recomputation
+"""
+
+import numpy as np
+
+import gridworld
+import tables
+
+def assertGreedyCache(qtable):
+    masked = np.where(qtable.legalActions, qtable.array, -np.inf)
+    for s in range(len(qtable.states)):
+        if not qtable.hasActions[s]:
+            assert qtable.getGreedyIndex(s) is None
+            assert qtable.getMaxValue(s) == 0.0
+            continue
+        assert qtable.getGreedyIndex(s) == int(masked[s].argmax())
+        assert qtable.getMaxValue(s) == masked[s].max()
+
+def test_greedyCacheFollowsWrites():
+    model = gridworld.getBookGrid().compile()
+    qtable = tables.QTable.fromModel(model)
+    rng = np.random.default_rng(0)
+    assertGreedyCache(qtable)
+    legal = np.argwhere(model.legalActions)
+    for i in range(2000):
+        s, a = legal[rng.integers(len(legal))]
+        # Few distinct values, so that there are ties
+        value = float(rng.integers(-3, 3))
+        if i % 2:
+            qtable.setValue(s, a, value)
+        else:
+            qtable[(model.states[s], model.actions[a])] = value
+        assertGreedyCache(qtable)
+
+def test_greedyCacheRefresh():
+    model = gridworld.getMazeGrid().compile()
+    qtable = tables.QTable.fromModel(model)
+    assertGreedyCache(qtable)
+    rng = np.random.default_rng(1)
+    qtable.array[:] = rng.normal(size=qtable.array.shape)
+    qtable.refreshGreedy(rows=np.arange(len(qtable.states)))
+    assertGreedyCache(qtable)
+    qtable.fill({key: -value for key, value in qtable.items()})
+    assertGreedyCache(qtable)
+
+def test_greedyAction():
+    model = gridworld.getBookGrid().compile()
+    qtable = tables.QTable.fromModel(model)
+    state = (0, 0)
+    assert qtable.getGreedyAction(state) == 'north'
+    qtable[(state, 'east')] = 1.0
+    assert qtable.getGreedyAction(state) == 'east'
+    qtable[(state, 'east')] = 0.0
+    assert qtable.getGreedyAction(state) == 'north'
+    assert qtable.getGreedyAction('TERMINAL_STATE') is None
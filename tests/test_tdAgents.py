@@ -0,0 +1,89 @@
+"""
+Checks of the replay buffer and of the learned model and the updates of DynaQAgent
+"""
+
+import random
+
+import numpy as np
+import pytest
+
+import gridworld
+import tdAgents
+
+def test_dynaQExpectedBackup():
+    mdp = gridworld.getBookGrid()
+    env = gridworld.GridworldEnvironment(mdp)
+    agent = tdAgents.DynaQAgent(env, discount = 0.9, planningSteps = 0)
+    model = agent.model
+    s, a = model.stateIndex[(0, 0)], model.actionIndex['north']
+    key = s*model.numActions + a
+    successors = [nextState for nextState, _ in model.getTransitionStatesAndProbs((0, 0), 'north')]
+    observed = [successors[0]]*3 + [successors[1]]
+    for nextState in observed:
+        agent._observe(key, -0.5, model.stateIndex[nextState])
+    for nextState, value in zip(successors, [1.0, 2.0, 4.0]):
+        agent.qvalues.setValue(model.stateIndex[nextState], model.actionIndex['east'], value)
+
+    assert agent.observedKeys == [key]
+    assert agent.modelCounts[key].tolist()[:len(successors)] == [3, 1, 0]
+    expected = -0.5 + 0.9*(0.75*1.0 + 0.25*2.0)
+    assert agent._getTDError(key) == pytest.approx(expected)
+    assert agent.predecessors[model.stateIndex[successors[0]]] == {key}
+    assert model.stateIndex[successors[2]] not in agent.predecessors
+
+def test_dynaQRealStepIsSampled():
+    mdp = gridworld.getBookGrid()
+    env = gridworld.GridworldEnvironment(mdp)
+    agent = tdAgents.DynaQAgent(env, discount = 0.9, alpha = 0.5, epsilon = 0.0, planningSteps = 0)
+    agent.getPossibleActions = mdp.getPossibleActions
+    agent.isTerminal = mdp.isTerminal
+    model = agent.model
+    agent.qvalues.setValue(model.stateIndex[(0, 1)], model.actionIndex['north'], 2.0)
+    env.reset()
+    agent.newEpisode()
+    agent.run()
+    nextState = env.getCurrentState()
+    expected = 0.5*(0.0 + 0.9*agent.qvalues.getMaxValue(model.stateIndex[nextState]))
+    assert agent.getQValue((0, 0), 'north') == pytest.approx(expected)
+
+def test_dynaQQueueStaysSmall():
+    random.seed(0)
+    mdp = gridworld.getMazeGrid()
+    env = gridworld.GridworldEnvironment(mdp)
+    agent = tdAgents.DynaQAgent(env, discount = 0.9, alpha = 0.1, planningSteps = 5, prioritized = True)
+    agent.getPossibleActions = mdp.getPossibleActions
+    agent.isTerminal = mdp.isTerminal
+    numKeys = len(agent.modelTotals)
+    for _ in range(20):
+        env.reset()
+        agent.newEpisode()
+        while agent.run():
+            assert len(agent.queue.heap) <= 2*numKeys
+    queued = [item for _, _, item in agent.queue.heap if agent.queuedPriorities.get(item[0]) == item[1]]
+    assert sorted(key for key, _ in queued) == sorted(agent.queuedPriorities)
+
+def test_sumTree():
+    rng = np.random.default_rng(0)
+    tree = tdAgents.SumTree(37)
+    values = np.zeros(37)
+    for _ in range(20):
+        indices = rng.integers(0, 37, 5)
+        newValues = rng.uniform(0, 3, 5)
+        tree.set(indices, newValues)
+        values[indices] = newValues
+        index = int(rng.integers(0, 37))
+        values[index] = rng.uniform(0, 3)
+        tree.setValue(index, values[index])
+        assert tree.total() == pytest.approx(values.sum())
+        prefixSums = rng.uniform(0, values.sum(), 100)
+        expected = np.searchsorted(np.cumsum(values), prefixSums, side='right')
+        assert tree.find(prefixSums).tolist() == expected.tolist()
+
+def test_prioritizedSampling():
+    buffer = tdAgents.ReplayBuffer(10, prioritized = True, alpha = 1.0, seed = 0)
+    for i in range(7):
+        buffer.add(i, 0, 0.0, 0, False)
+    buffer.updatePriorities(np.arange(7), np.arange(1.0, 8.0), epsilon = 0.0)
+    indices = buffer.sample(100000)[0]
+    assert indices.max() < 7
+    assert np.allclose(np.bincount(indices, minlength=7)/100000, np.arange(1, 8)/28, atol=0.005)
@@ -31,7 +31,7 @@ class TextGridworldDisplay:
             print (message)
         values = util.Counter()
         policy = {}
-        states = self.gridworld.getStates()
+        states = self.gridworld.getStateIndex().states
         for state in states:
             values[state] = agent.getValue(state)
             policy[state] = agent.getPolicy(state)
@@ -47,13 +47,13 @@ class TextGridworldDisplay:
     def displayQValuesGivenAgent(self, agent, currentState = None, message = None):
         if message != None: print (message)
         qValues = util.Counter()
-        states = self.gridworld.getStates()
+        states = self.gridworld.getStateIndex().states
         for state in states:
             for action in self.gridworld.getPossibleActions(state):
                 qValues[(state, action)] = agent.getQValue(state, action)
         prettyPrintQValues(self.gridworld, qValues, currentState)
 
-    def displayQValuesGivenAgent(self, qValues, currentState = None, message = None):
+    def displayQValues(self, qValues, currentState = None, message = None):
         if message != None: print (message)
         prettyPrintQValues(self.gridworld, qValues, currentState)
 